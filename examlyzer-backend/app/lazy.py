@@ -0,0 +1,21 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is only imported on first attribute access"""
+
+    def __getattr__(self, attr):
+        # import_module holds the import lock, so concurrent first uses are safe
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Import a module on first attribute access instead of right away.
+
+    cv2, numpy and reportlab account for most of the time it takes to import
+    the app, but nothing needs them until the first frame or report.
+    """
+    return LazyModule(name)
@@ -1,16 +1,109 @@
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Depends, FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from .database import Base, engine
-from .routes import students, websocket , reports, count_people
+from .routes import students, websocket , reports, count_people, exams
+from .services import checkpoints, face_detection, room_monitor as room_monitor_service
+from .services.admission import EXAM_CAPACITY_DIR
+from .services.analysis_pool import InlineAnalysisBackend, analysis_backend
 from .services.auth import authenticate_admin, create_access_token
+from .services.evidence import EVIDENCE_DIR
+from .services.room_monitor import room_monitor
+from .services.rules import EXAM_RULES_DIR
+from .services.signals import SIGNALS_DIR
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
 import uvicorn
 
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
+
+DATA_DIRS = (reports.REPORTS_DIR, EXAM_RULES_DIR, SIGNALS_DIR, EVIDENCE_DIR, checkpoints.CHECKPOINT_DIR,
+             EXAM_CAPACITY_DIR)
+
+def preload_models():
+    """Load the detection models in parallel, they are independent of each other"""
+    # Only the inline backend analyzes in this process, the process backend's workers load their own
+    analysis_threads = analysis_backend.threads if isinstance(analysis_backend, InlineAnalysisBackend) else 0
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        for future in [pool.submit(face_detection.preload, analysis_threads),
+                       pool.submit(room_monitor_service.preload)]:
+            future.result()
+
+# Preload-then-fork: with EXAMLYZER_PRELOAD=1 and `gunicorn --preload`, the models
+# are loaded once in the master and shared copy-on-write by every forked worker
+if os.getenv("EXAMLYZER_PRELOAD") == "1":
+    preload_models()
+
+async def warm_up(app: FastAPI):
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(preload_models)
+        # The process backend loads its own models in every analysis process
+        await analysis_backend.wait_ready()
+    except Exception as e:
+        logger.error(f"Failed to load detection models: {e}")
+        return
+    app.state.ready = True
+    logger.info(f"Detection models ready after {time.perf_counter() - started:.2f}s")
+
+def install_drain_handler():
+    """On SIGTERM, drain live sessions first, then let the server's own handler shut it down"""
+    if threading.current_thread() is not threading.main_thread():
+        return  # Signal handlers can only be installed from the main thread
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def exit_with_previous_handler():
+        signal.signal(signal.SIGTERM, previous)
+        signal.raise_signal(signal.SIGTERM)
+
+    async def drain_then_exit():
+        try:
+            await websocket.drain_sessions()
+        finally:
+            exit_with_previous_handler()
+
+    def handle_sigterm(signum, frame):
+        if checkpoints.draining:
+            # Second SIGTERM, stop waiting for the drain
+            loop.call_soon_threadsafe(exit_with_previous_handler)
+            return
+        logger.info("SIGTERM received, draining monitoring sessions")
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(drain_then_exit()))
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    for directory in DATA_DIRS:
+        directory.mkdir(exist_ok=True)
+    await asyncio.to_thread(Base.metadata.create_all, bind=engine)
+    await asyncio.to_thread(checkpoints.remove_expired)
+    await room_monitor.start()
+    await analysis_backend.start()
+    install_drain_handler()
+    # Serve requests right away, /ready reports when the detectors are warm
+    warm_up_task = asyncio.create_task(warm_up(app))
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await analysis_backend.stop()
+        await room_monitor.stop()
+
 app = FastAPI(
     title="Examlyzer - Remote Exam Monitoring System",
     description="Graduation Project for monitoring students during online exams using AI.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -21,6 +114,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    if checkpoints.draining:
+        return JSONResponse(status_code=503, content={"status": "draining"})
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
 @app.post("/admin/login")
 def login_teacher(form_data: OAuth2PasswordRequestForm = Depends()):
     user = authenticate_admin(form_data.username, form_data.password)
@@ -59,5 +164,6 @@ app.include_router(websocket.router, prefix="/ws", tags=["WebSocket"])
 app.include_router(students.router, prefix="/api", tags=["Students"])
 app.include_router(reports.router, prefix="/api", tags=["Reports"])
 app.include_router(count_people.router, prefix="/api", tags=["Count People"])
+app.include_router(exams.router, prefix="/api", tags=["Exams"])
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Boolean, Column, Float, Integer, String
 from .database import Base
 
 class Student(Base):
@@ -16,4 +16,33 @@ class Teacher(Base):
     id = Column(Integer, primary_key=True, index=True)
     full_name = Column(String, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
-    hashed_password = Column(String, nullable=False)
\ No newline at end of file
+    hashed_password = Column(String, nullable=False)
+
+class ExamStatCounter(Base):
+    """One named per-exam counter, incremented in place by every worker"""
+    __tablename__ = "exam_stat_counters"
+
+    exam_id = Column(String, primary_key=True)
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class ExamStudentStats(Base):
+    """A student's session in an exam; reconnects and resumes reuse the same row"""
+    __tablename__ = "exam_student_stats"
+
+    exam_id = Column(String, primary_key=True)
+    student_id = Column(String, primary_key=True)
+    started_at = Column(Float, nullable=False)
+    seen_at = Column(Float, nullable=False)
+    active = Column(Boolean, nullable=False, default=False)
+    ended = Column(Boolean, nullable=False, default=False)
+    terminated = Column(Boolean, nullable=False, default=False)
+    first_violation_at = Column(Float, nullable=True)
+
+class ExamFlaggedStudent(Base):
+    """A student flagged at least once for a reason"""
+    __tablename__ = "exam_flagged_students"
+
+    exam_id = Column(String, primary_key=True)
+    reason = Column(String, primary_key=True)
+    student_id = Column(String, primary_key=True)
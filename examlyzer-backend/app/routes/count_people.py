@@ -1,32 +1,31 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
-import cv2
-import numpy as np
-import requests
+from ..services.room_monitor import room_monitor
 
 router = APIRouter()
 
-ESP32_CAM_URL = "http://192.168.137.216/cam-hi.jpg"  
 @router.get("/count_people/")
-def count_people():
-    try:
-        # Step 1: Fetch image from ESP32
-        response = requests.get(ESP32_CAM_URL, timeout=5)
-        image_array = np.frombuffer(response.content, np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+async def count_people(camera: str = None):
+    # Counts are kept up to date by the background poller, this only reads the cache
+    name = camera or next(iter(room_monitor.cameras))
+    if name not in room_monitor.cameras:
+        return JSONResponse(status_code=404, content={
+            "error": f"Unknown camera {name}",
+            "status": "failed"
+        })
 
-        # Step 2: People detection using HOG + SVM
-        hog = cv2.HOGDescriptor()
-        hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
-        boxes, _ = hog.detectMultiScale(image, winStride=(8, 8))
+    entry = room_monitor.get(name)
+    if entry is None:
+        # Poller has not reached this camera yet; never fetch from the request itself
+        return JSONResponse(status_code=503, content={"camera": name, "status": "pending"})
 
-        return JSONResponse(content={
-            "people_count": len(boxes),
-            "status": "success"
-        })
+    if entry["status"] != "success" and entry.get("people_count") is None:
+        return JSONResponse(status_code=500, content=entry)
+    return JSONResponse(content=entry)
 
-    except Exception as e:
-        return JSONResponse(status_code=500, content={
-            "error": str(e),
-            "status": "failed"
-        })
+@router.get("/count_people/cameras")
+async def list_cameras():
+    return {
+        name: room_monitor.get(name) or {"camera": name, "status": "pending"}
+        for name in room_monitor.cameras
+    }
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, HTTPException
+from ..schemas import ExamCapacityConfig, ExamRulesConfig
+from ..services import admission, analytics, rules, signals
+
+router = APIRouter(prefix="/exams", tags=["Exams"])
+
+@router.get("/{exam_id}/rules", response_model=ExamRulesConfig)
+async def get_exam_rules(exam_id: str):
+    """Violation rules applied to new sessions of an exam"""
+    return rules.get_exam_rules(exam_id).config
+
+@router.put("/{exam_id}/rules", response_model=ExamRulesConfig)
+async def update_exam_rules(exam_id: str, config: ExamRulesConfig):
+    """Replace an exam's violation rules, running sessions keep their current rules"""
+    try:
+        return rules.set_exam_rules(exam_id, config).config
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/{exam_id}/rules")
+async def reset_exam_rules(exam_id: str):
+    """Go back to the default violation rules"""
+    rules.reset_exam_rules(exam_id)
+    return {"status": "success", "message": f"Rules for exam {exam_id} reset to defaults"}
+
+@router.get("/{exam_id}/students/{student_id}/timeline")
+async def get_student_timeline(exam_id: str, student_id: str, resolution: str = "10s"):
+    """Per-frame signals of a student's session, raw or rolled up to 1s, 10s or 1m buckets"""
+    if resolution != "raw" and resolution not in signals.RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported resolution {resolution}")
+
+    timeline = signals.get_timeline(exam_id, student_id, resolution)
+    if timeline is None:
+        raise HTTPException(status_code=404, detail="No signals recorded for this student")
+    return {
+        "exam_id": exam_id,
+        "student_id": student_id,
+        "resolution": resolution,
+        "points": len(timeline["t"]),
+        **timeline
+    }
+
+@router.get("/{exam_id}/stats")
+def get_exam_stats(exam_id: str):
+    """Aggregates kept up to date as sessions run, no stored reports are scanned"""
+    return analytics.get_exam_stats(exam_id).to_dict()
+
+@router.get("/{exam_id}/capacity")
+async def get_exam_capacity(exam_id: str):
+    """An exam's quota and weight with its live share of the analysis capacity"""
+    return admission.admission.exam_usage(exam_id)
+
+@router.put("/{exam_id}/capacity", response_model=ExamCapacityConfig)
+async def update_exam_capacity(exam_id: str, config: ExamCapacityConfig):
+    """Set how many sessions an exam gets at full rate and its weight, applied to running sessions"""
+    try:
+        return admission.set_exam_capacity(exam_id, config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/{exam_id}/capacity")
+async def reset_exam_capacity(exam_id: str):
+    """Go back to the default quota and weight"""
+    admission.reset_exam_capacity(exam_id)
+    return {"status": "success", "message": f"Capacity settings for exam {exam_id} reset to defaults"}
@@ -6,11 +6,11 @@ import json
 from datetime import datetime
 from typing import List, Dict
 import os
+from ..services.evidence import EVIDENCE_DIR
 
 router = APIRouter()
 
 REPORTS_DIR = Path("reports")
-REPORTS_DIR.mkdir(exist_ok=True)
 
 class Report:
     def __init__(self, file_path: Path):
@@ -61,6 +61,14 @@ async def list_reports():
     # Sort by timestamp (newest first)
     return sorted(reports, key=lambda x: x['timestamp'], reverse=True)
 
+@router.get("/reports/evidence/{exam_id}/{filename}")
+async def get_evidence(exam_id: str, filename: str):
+    """Download an evidence clip linked from a report"""
+    file_path = EVIDENCE_DIR / Path(exam_id).name / Path(filename).name
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Evidence not found or evicted")
+    return FileResponse(file_path, media_type="image/jpeg", filename=file_path.name)
+
 @router.get("/reports/{filename}")
 async def get_report(filename: str):
     """Get detailed report data"""
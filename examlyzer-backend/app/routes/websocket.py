@@ -2,14 +2,19 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict, Optional
 from datetime import datetime
 from pathlib import Path
-from ..services import face_detection
-import numpy as np
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+from ..services import analytics, checkpoints, rules, signals
+from ..services.admission import admission
+from ..services.analysis_pool import analysis_backend, session_key
+from ..services.evidence import EvidenceRecorder, evidence_file
+from ..services.room_monitor import room_monitor
+from ..lazy import lazy_import
+import asyncio
 import io
 import json
 import logging
+import time
+
+np = lazy_import("numpy")
 
 router = APIRouter()
 
@@ -19,7 +24,6 @@ logger = logging.getLogger(__name__)
 
 active_students: Dict[str, Dict] = {}
 REPORTS_DIR = Path("reports")
-REPORTS_DIR.mkdir(exist_ok=True)
 
 class ViolationTracker:
     def __init__(self, max_violations: int = 3):
@@ -28,12 +32,15 @@ class ViolationTracker:
         self.violation_history = []
         self.last_violation_time = None
         
-    def add_violation(self, reason: str, details: dict):
-        self.violations += 1
+    def add_violation(self, reason: str, details: dict, severity: int = 1,
+                      evidence: Optional[str] = None):
+        self.violations += severity
         violation_record = {
             "timestamp": datetime.now().isoformat(),
             "reason": reason,
-            "details": details
+            "severity": severity,
+            "details": details,
+            "evidence": evidence
         }
         self.violation_history.append(violation_record)
         self.last_violation_time = datetime.now()
@@ -47,26 +54,113 @@ class ViolationTracker:
             return None
         return (datetime.now() - self.last_violation_time).total_seconds()
 
+    def to_state(self) -> dict:
+        return {
+            "violations": self.violations,
+            "violation_history": self.violation_history,
+            "last_violation_time": self.last_violation_time.isoformat() if self.last_violation_time else None
+        }
+
+    def load_state(self, state: dict):
+        self.violations = state["violations"]
+        self.violation_history = state["violation_history"]
+        if state["last_violation_time"]:
+            self.last_violation_time = datetime.fromisoformat(state["last_violation_time"])
+
 @router.websocket("/monitor/{student_id}/{exam_id}")
-async def websocket_endpoint(websocket: WebSocket, student_id: str, exam_id: str):
+async def websocket_endpoint(websocket: WebSocket, student_id: str, exam_id: str,
+                             resume: Optional[str] = None):
+    if checkpoints.draining:
+        # This worker is shutting down, the client should retry against its replacement
+        await websocket.close(code=1013)
+        return
     await websocket.accept()
-    tracker = ViolationTracker(max_violations=3)
+    # Rules are compiled once per exam, each session gets its own evaluation state
+    rules_engine = rules.get_exam_rules(exam_id).new_engine()
+    tracker = ViolationTracker(max_violations=rules_engine.max_violations)
+    # Each session keeps its own detector (movement history, pre-filter cache) in the analysis backend
+    key = session_key(student_id, exam_id)
+    series = signals.open_series(exam_id, student_id)
+    evidence = EvidenceRecorder(exam_id, student_id)
+    # Over the exam's quota or under load the session is sampled rather than refused
+    ticket = admission.admit(exam_id, student_id)
+    sample_every = 1
     is_closed = False
+    terminated = False
+    registered = False
+    last_seen = time.time()
     
     try:
         # Register student as active
-        active_students[student_id] = {
+        session = active_students[student_id] = {
             "exam_id": exam_id,
             "start_time": datetime.now(),
-            "status": "monitoring"
+            "status": "monitoring",
+            "frames": 0,
+            "skipped_frames": 0,
+            "key": key,
+            "websocket": websocket,
+            "tracker": tracker,
+            "rules_engine": rules_engine,
+            "admission": ticket
         }
         
+        # Pick up where a draining worker left off
+        checkpoint = await asyncio.to_thread(checkpoints.load_checkpoint, resume, student_id, exam_id) if resume else None
+        if checkpoint is not None:
+            tracker.load_state(checkpoint["tracker"])
+            rules_engine.load_state(checkpoint["rules"])
+            if checkpoint["detector"] is not None:
+                analysis_backend.restore_session(key, checkpoint["detector"])
+            session["frames"] = checkpoint["frames"]
+            session["skipped_frames"] = checkpoint["skipped_frames"]
+            logger.info(f"Resumed session for student {student_id} with {tracker.violations} violation(s)")
+        elif resume:
+            await websocket.send_json({
+                "type": "error",
+                "message": "Resume token invalid or expired, monitoring restarted",
+                "timestamp": datetime.now().isoformat()
+            })
+        
+        await asyncio.to_thread(analytics.session_started, exam_id, student_id)
+        registered = True
+        
         logger.info(f"Started monitoring student {student_id} for exam {exam_id}")
         
         while True:
             try:
                 data = await websocket.receive_bytes()
-                result = face_detection.cheating_detector.analyze_frame(data)
+                if session["status"] == "draining":
+                    # Checkpointed already, anything recorded now would be lost on resume
+                    continue
+                evidence.push(data)
+                if ticket.stride != sample_every:
+                    # Let the client slow its uploads down (or speed them back up)
+                    sample_every = ticket.stride
+                    await websocket.send_json({
+                        "type": "sampling",
+                        "message": f"Server busy, analyzing 1 in {sample_every} frames" if sample_every > 1
+                                   else "Analyzing every frame",
+                        "sample_every": sample_every,
+                        "timestamp": datetime.now().isoformat()
+                    })
+                if not ticket.should_analyze():
+                    await websocket.send_json({
+                        "type": "status",
+                        "message": "Monitoring normal",
+                        "violation_count": tracker.violations,
+                        "timestamp": datetime.now().isoformat()
+                    })
+                    continue
+                async with ticket.analysis_slot():
+                    result = await analysis_backend.analyze(key, data)
+                if session["status"] == "draining":
+                    continue  # The drain started while this frame was being analyzed
+                session["frames"] += 1
+                session["skipped_frames"] += 1 if result.get("skipped") else 0
+                if time.time() - last_seen >= analytics.HEARTBEAT_INTERVAL:
+                    last_seen = time.time()
+                    await asyncio.to_thread(analytics.session_seen, exam_id, student_id)
 
                 # Convert NumPy types to native Python types for JSON serialization
                 result["details"] = {
@@ -75,56 +169,71 @@ async def websocket_endpoint(websocket: WebSocket, student_id: str, exam_id: str
                        v for k, v in result.get("details", {}).items()
                 }
 
-                if result["is_cheating"]:
-                    violations = tracker.add_violation(result["reason"], result["details"])
+                # Undecodable frames carry no detections, they only get a heartbeat
+                events = []
+                if "error" not in result:
+                    now = time.time()
+                    series.append(now, result["details"])
+                    events = rules_engine.evaluate(result["details"], now)
+
+                for event in events:
+                    await asyncio.to_thread(analytics.record_violation, exam_id, student_id, event["reason"])
+                    violations = tracker.add_violation(event["reason"], result["details"], event["severity"],
+                                                       evidence=evidence.capture(event["reason"]))
                     
                     # Send warning with violation count
                     warning_msg = (f"Violation {violations}/{tracker.max_violations}: "
-                                f"{result['reason']}")
+                                f"{event['reason']}")
                     
                     await websocket.send_json({
                         "type": "warning",
                         "message": warning_msg,
+                        "rule": event["rule"],
                         "violation_count": violations,
                         "details": result["details"],
                         "timestamp": datetime.now().isoformat()
                     })
                     
-                    logger.warning(f"Student {student_id} violation {violations}: {result['reason']}")
+                    logger.warning(f"Student {student_id} violation {violations}: {event['reason']}")
+                    
+                # Check if we should terminate the exam
+                if tracker.should_terminate():
+                    violations = tracker.violations
+                    termination_reason = (f"Exam terminated due to {violations} "
+                                    f"cheating violations")
+                    
+                    # Make sure the evidence linked from the report is on disk
+                    await evidence.flush()
+                    
+                    # Generate violation report
+                    report_data = {
+                        "student_id": student_id,
+                        "exam_id": exam_id,
+                        "violations": tracker.violation_history,
+                        "termination_time": datetime.now().isoformat()
+                    }
+                    
+                    # Save report to file
+                    report_path = REPORTS_DIR / f"violation_{student_id}_{exam_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+                    with open(report_path, "w") as f:
+                        json.dump(report_data, f, indent=2)
+                    
+                    # Send termination notice
+                    await websocket.send_json({
+                        "type": "termination",
+                        "reason": termination_reason,
+                        "violations": violations,
+                        "report_path": str(report_path),
+                        "timestamp": datetime.now().isoformat()
+                    })
                     
-                    # Check if we should terminate the exam
-                    if tracker.should_terminate():
-                        termination_reason = (f"Exam terminated due to {violations} "
-                                        f"cheating violations")
-                        
-                        # Generate violation report
-                        report_data = {
-                            "student_id": student_id,
-                            "exam_id": exam_id,
-                            "violations": tracker.violation_history,
-                            "termination_time": datetime.now().isoformat()
-                        }
-                        
-                        # Save report to file
-                        report_path = REPORTS_DIR / f"violation_{student_id}_{exam_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-                        with open(report_path, "w") as f:
-                            json.dump(report_data, f, indent=2)
-                        
-                        # Send termination notice
-                        await websocket.send_json({
-                            "type": "termination",
-                            "reason": termination_reason,
-                            "violations": violations,
-                            "report_path": str(report_path),
-                            "timestamp": datetime.now().isoformat()
-                        })
-                        
-                        logger.error(f"Terminating exam for student {student_id}: {termination_reason}")
-                        await websocket.close()
-                        is_closed = True
-                        break
+                    logger.error(f"Terminating exam for student {student_id}: {termination_reason}")
+                    await websocket.close()
+                    is_closed = True
+                    terminated = True
+                    break
                 
-                else:
+                if not events:
                     # Send regular heartbeat with status
                     await websocket.send_json({
                         "type": "status",
@@ -149,8 +258,17 @@ async def websocket_endpoint(websocket: WebSocket, student_id: str, exam_id: str
         logger.error(f"WebSocket error for student {student_id}: {str(e)}")
     finally:
         # Clean up
+        drained = active_students.get(student_id, {}).get("status") == "draining"
         if student_id in active_students:
             del active_students[student_id]
+        if registered and not drained:
+            # A drained session lives on in the worker that resumes it
+            await asyncio.to_thread(analytics.session_ended, exam_id, student_id, terminated)
+        admission.release(ticket)
+        analysis_backend.close_session(key)
+        signals.close_series(exam_id, student_id)
+        await evidence.flush()
+        evidence.close()
             
         if not is_closed:
             try:
@@ -160,8 +278,109 @@ async def websocket_endpoint(websocket: WebSocket, student_id: str, exam_id: str
                 
         logger.info(f"Ended monitoring session for student {student_id}")
 
+async def _checkpoint_session(student_id: str, session: Dict) -> Dict:
+    return {
+        "student_id": student_id,
+        "exam_id": session["exam_id"],
+        "created_at": time.time(),
+        "frames": session["frames"],
+        "skipped_frames": session["skipped_frames"],
+        "tracker": session["tracker"].to_state(),
+        "rules": session["rules_engine"].to_state(),
+        "detector": await analysis_backend.export_session(session["key"])
+    }
+
+async def _send_resume_token(session: Dict, token: str):
+    websocket = session["websocket"]
+    try:
+        await websocket.send_json({
+            "type": "reconnect",
+            "message": "Server is restarting, reconnect with the resume token",
+            "resume_token": token,
+            "timestamp": datetime.now().isoformat()
+        })
+        await websocket.close(code=1012)  # Service restart
+    except Exception as e:
+        logger.warning(f"Could not hand resume token to a client: {e}")
+
+async def drain_sessions():
+    """Stop taking sessions, checkpoint every live one and send its client a resume token"""
+    checkpoints.draining = True
+    started = time.perf_counter()
+    sessions = [(student_id, session) for student_id, session in list(active_students.items())
+                if session["status"] == "monitoring"]
+    for _, session in sessions:
+        session["status"] = "draining"
+
+    states = await asyncio.gather(*(_checkpoint_session(student_id, session) for student_id, session in sessions),
+                                  return_exceptions=True)
+    saved = {}
+    for (student_id, session), state in zip(sessions, states):
+        if isinstance(state, Exception):
+            logger.error(f"Could not checkpoint student {student_id}: {state}")
+            continue
+        saved[checkpoints.new_token()] = (session, state)
+    await asyncio.to_thread(checkpoints.write_checkpoints, {token: state for token, (_, state) in saved.items()})
+    # Before the clients can reconnect, so a resumed session is not marked drained after the fact
+    for student_id, session in sessions:
+        await asyncio.to_thread(analytics.session_drained, session["exam_id"], student_id)
+    await asyncio.gather(*(_send_resume_token(session, token) for token, (session, _) in saved.items()))
+
+    logger.info(f"Drained {len(saved)}/{len(sessions)} session(s) in {time.perf_counter() - started:.2f}s")
+
+@router.get("/monitor/metrics")
+async def monitor_metrics():
+    """Per-session analysis metrics, including how many frames the pre-filter skipped"""
+    sessions = {}
+    total_frames = skipped_frames = 0
+    for student_id, session in list(active_students.items()):
+        total_frames += session["frames"]
+        skipped_frames += session["skipped_frames"]
+        elapsed_time = (datetime.now() - session["start_time"]).total_seconds()
+        sessions[student_id] = {
+            "exam_id": session["exam_id"],
+            "total_frames": session["frames"],
+            "skipped_frames": session["skipped_frames"],
+            "skip_ratio": session["skipped_frames"] / session["frames"] if session["frames"] else 0.0,
+            "sample_every": session["admission"].stride,
+            "fps": session["frames"] / elapsed_time if elapsed_time > 0 else 0
+        }
+    return {
+        "active_sessions": len(sessions),
+        "total_frames": total_frames,
+        "skipped_frames": skipped_frames,
+        "skip_ratio": skipped_frames / total_frames if total_frames else 0.0,
+        "capacity": admission.summary(),
+        "sessions": sessions
+    }
+
+@router.websocket("/rooms")
+async def rooms_endpoint(websocket: WebSocket):
+    """Stream room camera people counts and alerts to supervisors"""
+    await websocket.accept()
+    queue = room_monitor.subscribe()
+    try:
+        # Send the current state first so the dashboard doesn't start empty
+        await websocket.send_json({
+            "type": "snapshot",
+            "cameras": [state.snapshot() for state in room_monitor.states.values()]
+        })
+        while True:
+            await websocket.send_json(await queue.get())
+    except WebSocketDisconnect:
+        logger.info("Room monitor subscriber disconnected")
+    except Exception as e:
+        logger.error(f"Room monitor websocket error: {str(e)}")
+    finally:
+        room_monitor.unsubscribe(queue)
+
 def generate_pdf_report(student_id: str, exam_id: str, violations: list) -> Path:
     """Generate a PDF violation report"""
+    # reportlab is only needed here, keep it out of the app import
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.utils import ImageReader
+    
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     report_path = REPORTS_DIR / f"violation_{student_id}_{exam_id}_{timestamp}.pdf"
     
@@ -197,6 +416,23 @@ def generate_pdf_report(student_id: str, exam_id: str, violations: list) -> Path
             c.drawString(80, y_position, line)
             y_position -= 15
         
+        # Evidence frames around the violation, if they were not evicted
+        evidence_url = violation.get('evidence')
+        evidence_path = evidence_file(evidence_url)
+        if evidence_path and evidence_path.exists():
+            image = ImageReader(str(evidence_path))
+            image_width, image_height = image.getSize()
+            draw_width = min(width - 152, image_width)
+            draw_height = image_height * draw_width / image_width
+            if y_position - draw_height < 72:
+                c.showPage()
+                y_position = height - 72
+            c.drawImage(image, 80, y_position - draw_height, width=draw_width, height=draw_height)
+            y_position -= draw_height + 5
+            c.setFont("Helvetica", 8)
+            c.drawString(80, y_position - 8, f"Evidence: {evidence_url}")
+            y_position -= 20
+        
         y_position -= 10
     
     c.save()
@@ -1,5 +1,5 @@
-from typing import Optional
-from pydantic import BaseModel, EmailStr
+from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
 
 class StudentLogin(BaseModel):
     email: EmailStr
@@ -19,3 +19,25 @@ class StudentOut(StudentBase):
 
     class Config:
         from_attributes = True
+
+class RuleCondition(BaseModel):
+    signal: str   # face_count, eyes_detected, movement_level or movement_percentage
+    op: str       # >, >=, <, <=, == or !=
+    value: float
+
+class RuleConfig(BaseModel):
+    name: str
+    reason: str
+    when: List[RuleCondition]
+    duration: float = Field(0.0, ge=0)   # Seconds the conditions must hold before the rule fires
+    debounce: float = Field(1.0, ge=0)   # Seconds the conditions must be clear before the episode ends
+    cooldown: float = Field(10.0, ge=0)  # Minimum seconds between two events of the same rule
+    severity: int = Field(1, ge=1)       # Violations counted per event
+
+class ExamRulesConfig(BaseModel):
+    max_violations: int = Field(3, ge=1)
+    rules: List[RuleConfig]
+
+class ExamCapacityConfig(BaseModel):
+    max_sessions: Optional[int] = None  # Sessions analyzed at the full frame rate, None for no quota
+    weight: float = 1.0                 # Share of the analysis capacity relative to other exams
@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+from ..schemas import ExamCapacityConfig
+from .analysis_pool import ProcessAnalysisBackend, analysis_backend
+
+logger = logging.getLogger(__name__)
+
+EXAM_CAPACITY_DIR = Path("exam_capacity")
+
+DEFAULT_EXAM_QUOTA = int(os.getenv("EXAMLYZER_EXAM_QUOTA", "0"))  # Full-rate sessions per exam, 0 for no quota
+TARGET_QUEUE_WAIT = float(os.getenv("EXAMLYZER_TARGET_QUEUE_WAIT", "0.2"))  # Seconds a frame may wait for analysis
+SATURATED_UTILIZATION = 0.9  # Busy fraction of the analysis capacity that counts as saturated
+RELAXED_UTILIZATION = 0.6    # Below this (and with short waits) sampling is stepped back up
+ADJUST_INTERVAL = 1.0        # Seconds between sampling rate adjustments
+MAX_STRIDE = 8               # Never analyze fewer than one in this many frames
+OVER_QUOTA_STRIDE = 2        # Sessions beyond an exam's quota analyze every other frame at best
+
+
+def default_concurrency() -> int:
+    """Frames analyzed at once: one per inline analysis thread, a couple per process"""
+    configured = os.getenv("EXAMLYZER_ANALYSIS_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    if isinstance(analysis_backend, ProcessAnalysisBackend):
+        # Two per process so a worker has its next frame ready when it finishes one
+        return analysis_backend.processes * 2
+    # More would only queue up inside the thread pool, out of the fair queue's reach
+    return analysis_backend.threads
+
+
+class ExamUsage:
+    """Live sessions of one exam and how much of the analysis capacity they use"""
+
+    def __init__(self, exam_id: str, config: ExamCapacityConfig):
+        self.exam_id = exam_id
+        self.config = config
+        self.sessions: "OrderedDict[str, Admission]" = OrderedDict()  # Oldest first
+        self.stride = 1  # Sampling stride applied to every session while the server is saturated
+        self.last_finish = 0.0  # Virtual finish tag of the exam's latest frame
+        self.in_flight = 0
+        self.queued = 0
+        self.frames_offered = 0
+        self.frames_analyzed = 0
+        # Reset every adjustment interval
+        self.window_busy = 0.0
+        self.window_wait = 0.0
+        self.window_frames = 0
+        self.analysis_share = 0.0
+        self.fair_share = 0.0
+        self.mean_queue_wait = 0.0
+
+    @property
+    def quota(self) -> Optional[int]:
+        return self.config.max_sessions
+
+    def rebalance(self):
+        """The oldest sessions up to the quota run at full rate, later ones are degraded"""
+        for index, admission in enumerate(self.sessions.values()):
+            admission.over_quota = self.quota is not None and index >= self.quota
+
+    def to_dict(self) -> Dict:
+        degraded = sum(1 for admission in self.sessions.values() if admission.over_quota)
+        return {
+            "exam_id": self.exam_id,
+            "max_sessions": self.quota,
+            "weight": self.config.weight,
+            "sessions": len(self.sessions),
+            "full_rate_sessions": len(self.sessions) - degraded,
+            "degraded_sessions": degraded,
+            "sample_every": self.stride,
+            "frames_offered": self.frames_offered,
+            "frames_analyzed": self.frames_analyzed,
+            "frames_sampled_out": self.frames_offered - self.frames_analyzed,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "mean_queue_wait_ms": self.mean_queue_wait * 1000,
+            "analysis_share": self.analysis_share,
+            "fair_share": self.fair_share,
+        }
+
+
+class Admission:
+    """An admitted session; decides which of its frames are analyzed"""
+
+    def __init__(self, controller: "AdmissionController", usage: ExamUsage, student_id: str):
+        self.controller = controller
+        self.usage = usage
+        self.student_id = student_id
+        self.over_quota = False
+        self.frame_index = 0
+
+    @property
+    def stride(self) -> int:
+        stride = self.usage.stride * (OVER_QUOTA_STRIDE if self.over_quota else 1)
+        return min(stride, MAX_STRIDE)
+
+    def should_analyze(self) -> bool:
+        """Count an incoming frame, False if it is sampled out"""
+        analyze = self.frame_index % self.stride == 0
+        self.frame_index += 1
+        self.usage.frames_offered += 1
+        return analyze
+
+    @asynccontextmanager
+    async def analysis_slot(self):
+        """Wait for this exam's turn at the analysis capacity"""
+        usage = self.usage
+        scheduler = self.controller.scheduler
+        queued_at = time.perf_counter()
+        await scheduler.acquire(usage)
+        started = time.perf_counter()
+        usage.in_flight += 1
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            usage.in_flight -= 1
+            usage.frames_analyzed += 1
+            usage.window_frames += 1
+            usage.window_wait += started - queued_at
+            usage.window_busy += finished - started
+            scheduler.release()
+            self.controller.maybe_adjust(finished)
+
+
+class FairScheduler:
+    """Start-time fair queuing of analysis work across exams.
+
+    Each frame gets a virtual start tag, the later of the scheduler's virtual
+    time and its exam's previous finish tag, and the exam's finish tag moves
+    on by 1/weight. Frames are dispatched lowest start tag first, so a busy
+    exam only gets ahead of the others in proportion to its weight no matter
+    how many sessions it has.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.busy = 0
+        self.queue = []  # (start tag, sequence, usage, future)
+        self.virtual_time = 0.0
+        self.sequence = itertools.count()
+
+    async def acquire(self, usage: ExamUsage):
+        start = max(self.virtual_time, usage.last_finish)
+        usage.last_finish = start + 1.0 / usage.config.weight
+        if self.busy < self.capacity and not self.queue:
+            self.busy += 1
+            self.virtual_time = start
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (start, next(self.sequence), usage, future))
+        usage.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        """Hand the slot to the queued frame with the lowest start tag"""
+        while self.queue:
+            start, _, usage, future = heapq.heappop(self.queue)
+            usage.queued -= 1
+            if future.cancelled():
+                continue
+            self.virtual_time = start
+            future.set_result(None)
+            return
+        self.busy -= 1
+
+
+class AdmissionController:
+    """Admits monitoring sessions under per-exam quotas and shares analysis fairly between exams.
+
+    Nobody is turned away: sessions beyond an exam's quota are admitted at a
+    reduced sampling rate, and when the analysis capacity is saturated the
+    exams using more than their weighted share sample fewer frames until the
+    queue wait comes back down.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.scheduler = FairScheduler(capacity or default_concurrency())
+        self.exams: Dict[str, ExamUsage] = {}
+        self.saturated = False
+        self.utilization = 0.0
+        self.last_adjust = time.perf_counter()
+
+    def admit(self, exam_id: str, student_id: str) -> Admission:
+        usage = self.exams.get(exam_id)
+        if usage is None:
+            usage = self.exams[exam_id] = ExamUsage(exam_id, get_exam_capacity(exam_id))
+        admission = Admission(self, usage, student_id)
+        # A reconnecting student takes the place of their old session
+        usage.sessions.pop(student_id, None)
+        usage.sessions[student_id] = admission
+        usage.rebalance()
+        if admission.over_quota:
+            logger.info(f"Exam {exam_id} is over its quota of {usage.quota} sessions, "
+                        f"student {student_id} admitted at a reduced sampling rate")
+        return admission
+
+    def release(self, admission: Admission):
+        usage = admission.usage
+        if usage.sessions.get(admission.student_id) is not admission:
+            return
+        del usage.sessions[admission.student_id]
+        usage.rebalance()
+        if not usage.sessions and not usage.in_flight and not usage.queued:
+            self.exams.pop(usage.exam_id, None)
+
+    def configure(self, exam_id: str, config: ExamCapacityConfig):
+        usage = self.exams.get(exam_id)
+        if usage is not None:
+            usage.config = config
+            usage.rebalance()
+
+    def maybe_adjust(self, now: float):
+        """Step sampling strides down under saturation and back up once it clears"""
+        elapsed = now - self.last_adjust
+        if elapsed < ADJUST_INTERVAL:
+            return
+        self.last_adjust = now
+
+        exams = list(self.exams.values())
+        busy = sum(usage.window_busy for usage in exams)
+        frames = sum(usage.window_frames for usage in exams)
+        mean_wait = sum(usage.window_wait for usage in exams) / frames if frames else 0.0
+        self.utilization = busy / (elapsed * self.scheduler.capacity)
+        self.saturated = self.utilization >= SATURATED_UTILIZATION or mean_wait > TARGET_QUEUE_WAIT
+        relaxed = self.utilization < RELAXED_UTILIZATION and mean_wait < TARGET_QUEUE_WAIT / 2
+
+        # Fair shares are split between the exams that actually sent work
+        loaded = [usage for usage in exams if usage.window_frames]
+        total_weight = sum(usage.config.weight for usage in loaded)
+        for usage in exams:
+            usage.fair_share = usage.config.weight / total_weight if usage.window_frames else 0.0
+            usage.analysis_share = usage.window_busy / busy if busy else 0.0
+            usage.mean_queue_wait = usage.window_wait / usage.window_frames if usage.window_frames else 0.0
+
+            previous = usage.stride
+            if self.saturated and usage.window_frames and usage.analysis_share >= usage.fair_share:
+                usage.stride = min(usage.stride * 2, MAX_STRIDE)
+            elif relaxed:
+                usage.stride = max(usage.stride // 2, 1)
+            if usage.stride != previous:
+                logger.info(f"Exam {usage.exam_id} now samples 1 in {usage.stride} frame(s) "
+                            f"(utilization {self.utilization:.0%}, queue wait {mean_wait * 1000:.0f} ms)")
+
+            usage.window_busy = usage.window_wait = 0.0
+            usage.window_frames = 0
+
+    def exam_usage(self, exam_id: str) -> Dict:
+        usage = self.exams.get(exam_id)
+        if usage is None:
+            usage = ExamUsage(exam_id, get_exam_capacity(exam_id))
+        return usage.to_dict()
+
+    def summary(self) -> Dict:
+        return {
+            "capacity": self.scheduler.capacity,
+            "busy": self.scheduler.busy,
+            "queued": len(self.scheduler.queue),
+            "utilization": self.utilization,
+            "saturated": self.saturated,
+            "exams": {exam_id: usage.to_dict() for exam_id, usage in list(self.exams.items())},
+        }
+
+
+_config_cache: Dict[str, ExamCapacityConfig] = {}
+
+
+def _capacity_path(exam_id: str) -> Path:
+    return EXAM_CAPACITY_DIR / f"{Path(exam_id).name}.json"
+
+
+def _default_config() -> ExamCapacityConfig:
+    return ExamCapacityConfig(max_sessions=DEFAULT_EXAM_QUOTA or None)
+
+
+def get_exam_capacity(exam_id: str) -> ExamCapacityConfig:
+    """Quota and weight of an exam, falling back to the defaults"""
+    config = _config_cache.get(exam_id)
+    if config is None:
+        path = _capacity_path(exam_id)
+        config = _default_config()
+        if path.exists():
+            try:
+                with open(path, "r") as f:
+                    config = ExamCapacityConfig(**json.load(f))
+            except Exception as e:
+                logger.error(f"Invalid capacity settings for exam {exam_id}, using defaults: {e}")
+        _config_cache[exam_id] = config
+    return config
+
+
+def set_exam_capacity(exam_id: str, config: ExamCapacityConfig) -> ExamCapacityConfig:
+    """Validate, save and apply an exam's quota and weight, running sessions included"""
+    if config.weight <= 0:
+        raise ValueError("Weight must be positive")
+    if config.max_sessions is not None and config.max_sessions < 0:
+        raise ValueError("max_sessions cannot be negative")
+    with open(_capacity_path(exam_id), "w") as f:
+        json.dump(config.model_dump(), f, indent=2)
+    _config_cache[exam_id] = config
+    admission.configure(exam_id, config)
+    return config
+
+
+def reset_exam_capacity(exam_id: str):
+    path = _capacity_path(exam_id)
+    if path.exists():
+        path.unlink()
+    _config_cache.pop(exam_id, None)
+    admission.configure(exam_id, get_exam_capacity(exam_id))
+
+
+# Global instance shared by every monitoring session
+admission = AdmissionController()
@@ -0,0 +1,393 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+from .face_detection import CheatingDetector
+
+logger = logging.getLogger(__name__)
+
+# "inline" analyzes frames in threads of the websocket worker, "process" hands them to a process pool
+ANALYSIS_BACKEND = os.getenv("EXAMLYZER_ANALYSIS_BACKEND", "inline")
+ANALYSIS_THREADS = int(os.getenv("EXAMLYZER_ANALYSIS_THREADS", str(min(4, os.cpu_count() or 1))))
+ANALYSIS_PROCESSES = int(os.getenv("EXAMLYZER_ANALYSIS_PROCESSES", str(os.cpu_count() or 1)))
+SLOT_SIZE = int(os.getenv("EXAMLYZER_FRAME_SLOT_BYTES", str(512 * 1024)))  # Largest accepted frame
+SLOTS_PER_PROCESS = 8
+RESPAWN_DELAY = 1.0  # Seconds before a dead analysis process is restarted
+
+# Parent -> worker: op, request id, slot, frame length, key length, then the session
+# key as UTF-8 and, for OP_RESTORE, the detector state as JSON
+OP_ANALYZE = 1
+OP_CLOSE = 2
+OP_EXPORT = 3
+OP_RESTORE = 4
+REQUEST = struct.Struct("<BIIIH")
+
+# Worker -> parent: request id, flags, face_count, eyes_detected, movement_level,
+# movement_percentage, processing_time, fps; FLAG_READY is sent once the worker has loaded its
+# models, FLAG_STATE replies carry JSON state after it
+FLAG_ERROR = 1
+FLAG_SKIPPED = 2
+FLAG_READY = 4
+FLAG_STATE = 8
+RESULT = struct.Struct("<IBHHqddd")
+
+
+def session_key(student_id: str, exam_id: str) -> str:
+    return f"{exam_id}/{student_id}"
+
+
+def pack_result(request_id: int, result: dict) -> bytes:
+    details = result.get("details", {})
+    flags = (FLAG_ERROR if "error" in result else 0) | (FLAG_SKIPPED if result.get("skipped") else 0)
+    return RESULT.pack(
+        request_id, flags,
+        int(details.get("face_count", 0)), int(details.get("eyes_detected", 0)),
+        int(details.get("movement_level", 0)), float(details.get("movement_percentage", 0.0)),
+        float(details.get("processing_time", 0.0)), float(details.get("fps", 0.0)),
+    )
+
+
+def pack_request(op: int, key: str, request_id: int = 0, slot: int = 0, length: int = 0,
+                 payload: bytes = b"") -> bytes:
+    encoded_key = key.encode()
+    return REQUEST.pack(op, request_id, slot, length, len(encoded_key)) + encoded_key + payload
+
+
+def unpack_result(data: bytes):
+    (request_id, flags, face_count, eyes_detected, movement_level,
+     movement_percentage, processing_time, fps) = RESULT.unpack_from(data)
+    if flags & FLAG_STATE:
+        payload = data[RESULT.size:]
+        return request_id, json.loads(payload) if payload else None
+    result = {
+        "details": {
+            "face_count": face_count,
+            "eyes_detected": eyes_detected,
+            "movement_level": movement_level,
+            "movement_percentage": movement_percentage,
+            "processing_time": processing_time,
+            "fps": fps,
+        },
+        "skipped": bool(flags & FLAG_SKIPPED),
+    }
+    if flags & FLAG_ERROR:
+        result["error"] = "Frame analysis failed"
+    return request_id, result
+
+
+def _worker_main(shm_name: str, requests, results):
+    """Analysis process: reads frames out of shared memory, keeps a detector per pinned session"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    CheatingDetector.load_cascades()
+    results.send_bytes(RESULT.pack(0, FLAG_READY, 0, 0, 0, 0.0, 0.0, 0.0))
+    detectors: Dict[str, CheatingDetector] = {}
+    try:
+        while True:
+            try:
+                message = requests.recv_bytes()
+            except EOFError:
+                break
+            op, request_id, slot, length, key_length = REQUEST.unpack_from(message)
+            key = message[REQUEST.size:REQUEST.size + key_length].decode()
+            if op == OP_CLOSE:
+                detectors.pop(key, None)
+                continue
+            if op == OP_EXPORT:
+                detector = detectors.get(key)
+                payload = json.dumps(detector.to_state()).encode() if detector else b""
+                results.send_bytes(RESULT.pack(request_id, FLAG_STATE, 0, 0, 0, 0.0, 0.0, 0.0) + payload)
+                continue
+            if op == OP_RESTORE:
+                detector = detectors[key] = CheatingDetector()
+                detector.load_state(json.loads(message[REQUEST.size + key_length:]))
+                continue
+
+            detector = detectors.get(key)
+            if detector is None:
+                detector = detectors[key] = CheatingDetector()
+            offset = slot * SLOT_SIZE
+            frame = shm.buf[offset:offset + length]
+            try:
+                # The detector decodes straight out of the shared buffer, no copy
+                result = detector.analyze_frame(frame)
+            except Exception as e:
+                result = {"error": str(e)}
+            finally:
+                try:
+                    frame.release()
+                except BufferError:
+                    pass  # Still referenced from a traceback, freed with it
+            results.send_bytes(pack_result(request_id, result))
+    finally:
+        shm.close()
+
+
+class InlineAnalysisBackend:
+    """Analyzes frames in a thread pool of the websocket worker, one detector per session.
+
+    OpenCV releases the GIL while it works, so the threads run in parallel
+    and the event loop stays free; a session's frames never overlap, so its
+    detector is only used by one thread at a time. Every thread has its own
+    Haar cascades, those are not safe to share.
+    """
+
+    def __init__(self, threads: int = ANALYSIS_THREADS):
+        self.threads = max(1, threads)
+        self.detectors: Dict[str, CheatingDetector] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="analysis",
+                                           initializer=CheatingDetector.load_cascades)
+
+    async def stop(self):
+        self.detectors.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def wait_ready(self):
+        pass  # Uses the cascades built by the app's warm-up
+
+    async def analyze(self, key: str, data: bytes) -> dict:
+        detector = self.detectors.get(key)
+        if detector is None:
+            detector = self.detectors[key] = CheatingDetector()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, detector.analyze_frame, data)
+
+    def close_session(self, key: str):
+        self.detectors.pop(key, None)
+
+    async def export_session(self, key: str) -> Optional[dict]:
+        detector = self.detectors.get(key)
+        return detector.to_state() if detector else None
+
+    def restore_session(self, key: str, state: dict):
+        detector = self.detectors[key] = CheatingDetector()
+        detector.load_state(state)
+
+
+class _Worker:
+    def __init__(self, index: int, first_slot: int, slots: int):
+        self.index = index
+        self.free_slots: asyncio.Queue = asyncio.Queue()
+        for slot in range(first_slot, first_slot + slots):
+            self.free_slots.put_nowait(slot)
+        self.ready = asyncio.Event()
+        self.alive = False
+        self.process = None
+        self.requests = None
+        self.reader: Optional[threading.Thread] = None
+
+
+class ProcessAnalysisBackend:
+    """Analyzes frames in a pool of processes fed through a shared-memory slot ring.
+
+    Frame bytes are copied once, into a slot owned by the session's worker;
+    the worker decodes them in place. Every session is pinned to one worker
+    by hashing its key, so its detector state never leaves that process.
+    Requests and results are small packed structs, nothing is pickled.
+    A worker that dies is respawned; its sessions start over with fresh
+    detectors.
+    """
+
+    def __init__(self, processes: int = ANALYSIS_PROCESSES, slots_per_process: int = SLOTS_PER_PROCESS):
+        self.processes = max(1, processes)
+        self.slots_per_process = slots_per_process
+        self.shm: Optional[shared_memory.SharedMemory] = None
+        self.workers = []
+        # request id -> (future, worker, slot); the slot stays busy until the result is back
+        self.pending: Dict[int, tuple] = {}
+        self.next_request_id = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.shm = shared_memory.SharedMemory(create=True, size=SLOT_SIZE * self.slots_per_process * self.processes)
+        for index in range(self.processes):
+            worker = _Worker(index, index * self.slots_per_process, self.slots_per_process)
+            self._spawn(worker)
+            self.workers.append(worker)
+        logger.info(f"Started {self.processes} analysis process(es) with {SLOT_SIZE // 1024} KB frame slots")
+
+    def _spawn(self, worker: _Worker):
+        # Spawn rather than fork, the parent already runs threads and an event loop
+        context = multiprocessing.get_context("spawn")
+        request_reader, worker.requests = context.Pipe(duplex=False)
+        result_reader, result_writer = context.Pipe(duplex=False)
+        worker.process = context.Process(
+            target=_worker_main, args=(self.shm.name, request_reader, result_writer),
+            name=f"analysis-{worker.index}", daemon=True,
+        )
+        worker.process.start()
+        request_reader.close()
+        result_writer.close()
+        worker.alive = True
+        worker.reader = threading.Thread(target=self._read_results, args=(worker, result_reader),
+                                         name=f"analysis-results-{worker.index}", daemon=True)
+        worker.reader.start()
+
+    async def wait_ready(self):
+        """Wait until every analysis process has loaded its models"""
+        await asyncio.gather(*(worker.ready.wait() for worker in self.workers))
+
+    async def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            worker.requests.close()
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for future, _, _ in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError("Analysis backend stopped"))
+        self.pending.clear()
+        self.workers = []
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def _read_results(self, worker: _Worker, connection):
+        while True:
+            try:
+                data = connection.recv_bytes()
+            except (EOFError, OSError):
+                connection.close()
+                try:
+                    self.loop.call_soon_threadsafe(self._worker_exited, worker)
+                except RuntimeError:
+                    pass  # Event loop already closed, the app is shutting down
+                return
+            if RESULT.unpack_from(data)[1] & FLAG_READY:
+                self.loop.call_soon_threadsafe(worker.ready.set)
+                continue
+            request_id, result = unpack_result(data)
+            self.loop.call_soon_threadsafe(self._resolve, request_id, result)
+
+    def _resolve(self, request_id: int, result: dict):
+        entry = self.pending.pop(request_id, None)
+        if entry is None:
+            return
+        future, worker, slot = entry
+        if slot is not None:
+            worker.free_slots.put_nowait(slot)
+        if not future.done():
+            future.set_result(result)
+
+    def _fail(self, request_id: int, error: Exception):
+        entry = self.pending.pop(request_id, None)
+        if entry is None:
+            return
+        future, worker, slot = entry
+        if slot is not None:
+            worker.free_slots.put_nowait(slot)
+        if not future.done():
+            future.set_exception(error)
+
+    def _worker_exited(self, worker: _Worker):
+        """Nothing the worker was analyzing will come back; free its slots and start a new one"""
+        worker.alive = False
+        worker.ready.clear()
+        error = RuntimeError(f"Analysis process {worker.index} exited")
+        for request_id, (_, owner, _) in list(self.pending.items()):
+            if owner is worker:
+                self._fail(request_id, error)
+        try:
+            worker.requests.close()
+        except OSError:
+            pass
+        if self.stopping or worker not in self.workers:
+            return
+        logger.error(f"Analysis process {worker.index} exited, restarting it")
+        self.loop.call_later(RESPAWN_DELAY, self._respawn, worker)
+
+    def _respawn(self, worker: _Worker):
+        if self.stopping or worker not in self.workers:
+            return
+        try:
+            self._spawn(worker)
+        except Exception as e:
+            logger.error(f"Could not restart analysis process {worker.index}: {e}")
+            self.loop.call_later(RESPAWN_DELAY, self._respawn, worker)
+
+    def _worker_for(self, key: str) -> _Worker:
+        return self.workers[zlib.crc32(key.encode()) % len(self.workers)]
+
+    def _send(self, worker: _Worker, message: bytes, request_id: Optional[int] = None):
+        """Write a request to the worker; if that fails, its pending request fails with it"""
+        try:
+            if not worker.alive:
+                raise BrokenPipeError("restarting")
+            worker.requests.send_bytes(message)
+        except OSError as e:
+            error = RuntimeError(f"Analysis process {worker.index} unavailable: {e}")
+            if request_id is None:
+                raise error from e
+            # Releases the slot, the caller sees the error when it awaits the request
+            self._fail(request_id, error)
+
+    async def analyze(self, key: str, data: bytes) -> dict:
+        if len(data) > SLOT_SIZE:
+            return {"error": "Frame too large"}
+        worker = self._worker_for(key)
+        slot = await worker.free_slots.get()
+        request_id, future = self._new_request(worker, slot)
+        offset = slot * SLOT_SIZE
+        try:
+            self.shm.buf[offset:offset + len(data)] = data
+        except Exception as e:
+            self._fail(request_id, e)
+            raise
+        self._send(worker, pack_request(OP_ANALYZE, key, request_id, slot, len(data)), request_id)
+        # If the caller goes away, the slot is still released when the result arrives
+        return await asyncio.shield(future)
+
+    def _new_request(self, worker: _Worker, slot: Optional[int]):
+        self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+        future = self.loop.create_future()
+        self.pending[self.next_request_id] = (future, worker, slot)
+        return self.next_request_id, future
+
+    def close_session(self, key: str):
+        if not self.workers:
+            return
+        try:
+            self._send(self._worker_for(key), pack_request(OP_CLOSE, key))
+        except RuntimeError:
+            pass  # A dead worker took the session's detector with it
+
+    async def export_session(self, key: str) -> Optional[dict]:
+        worker = self._worker_for(key)
+        request_id, future = self._new_request(worker, None)
+        self._send(worker, pack_request(OP_EXPORT, key, request_id), request_id)
+        return await future
+
+    def restore_session(self, key: str, state: dict):
+        try:
+            self._send(self._worker_for(key), pack_request(OP_RESTORE, key, payload=json.dumps(state).encode()))
+        except RuntimeError as e:
+            logger.warning(f"Could not restore detector state for {key}: {e}")
+
+
+def create_backend(name: str = ANALYSIS_BACKEND):
+    if name == "process":
+        return ProcessAnalysisBackend()
+    if name != "inline":
+        raise ValueError(f"Unknown analysis backend '{name}'")
+    return InlineAnalysisBackend()
+
+
+# Global instance, started by the app lifespan
+analysis_backend = create_backend()
@@ -0,0 +1,168 @@
+import logging
+import os
+import time
+from typing import Dict
+
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..database import SessionLocal
+from ..models import ExamFlaggedStudent, ExamStatCounter, ExamStudentStats
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the time-to-first-violation histogram, plus an overflow bucket
+FIRST_VIOLATION_BUCKETS = (30, 60, 120, 300, 600, 1200, 1800, 3600)
+# A session is live while its worker keeps checking in, so one left behind by a crashed worker drops out
+LIVE_SESSION_TIMEOUT = float(os.getenv("EXAMLYZER_LIVE_SESSION_TIMEOUT", "60"))
+HEARTBEAT_INTERVAL = LIVE_SESSION_TIMEOUT / 4
+
+
+class ExamStats:
+    """Aggregates for one exam, kept in the shared database and updated in place.
+
+    Every worker process writes to the same rows: counters are incremented
+    with upserts, and per-student state changes are conditional updates, so
+    a student's first session, first violation and termination are counted
+    once no matter which worker or connection reports them. Reading the
+    aggregates never depends on how many sessions or workers there were.
+    """
+
+    def __init__(self, exam_id: str):
+        self.exam_id = exam_id
+
+    def _student(self, student_id: str):
+        return and_(ExamStudentStats.exam_id == self.exam_id, ExamStudentStats.student_id == student_id)
+
+    def _set(self, db, student_id: str, *conditions, **values) -> bool:
+        """Update the student's row if the conditions hold, True if it changed"""
+        result = db.execute(update(ExamStudentStats).where(self._student(student_id), *conditions).values(**values))
+        return result.rowcount > 0
+
+    def _increment(self, db, counts: Dict[str, int]):
+        for name, amount in counts.items():
+            statement = insert(ExamStatCounter).values(exam_id=self.exam_id, name=name, value=amount)
+            db.execute(statement.on_conflict_do_update(
+                index_elements=[ExamStatCounter.exam_id, ExamStatCounter.name],
+                set_={"value": ExamStatCounter.value + statement.excluded.value},
+            ))
+
+    def session_started(self, student_id: str):
+        now = time.time()
+        with SessionLocal() as db:
+            inserted = db.execute(insert(ExamStudentStats).values(
+                exam_id=self.exam_id, student_id=student_id, started_at=now, seen_at=now, active=True,
+            ).on_conflict_do_nothing()).rowcount > 0
+            if inserted:
+                self._increment(db, {"sessions_started": 1})
+            else:
+                # A reconnect carries on with the student's session rather than starting another one
+                if self._set(db, student_id, ExamStudentStats.terminated.is_(True), terminated=False):
+                    self._increment(db, {"terminated": -1})
+                if self._set(db, student_id, ExamStudentStats.ended.is_(True), ended=False):
+                    self._increment(db, {"sessions_ended": -1})
+                self._set(db, student_id, active=True, seen_at=now)
+            db.commit()
+
+    def session_seen(self, student_id: str):
+        with SessionLocal() as db:
+            self._set(db, student_id, ExamStudentStats.active.is_(True), seen_at=time.time())
+            db.commit()
+
+    def session_drained(self, student_id: str):
+        """The session moves to another worker, which counts its end"""
+        with SessionLocal() as db:
+            self._set(db, student_id, active=False)
+            db.commit()
+
+    def session_ended(self, student_id: str, terminated: bool):
+        with SessionLocal() as db:
+            self._set(db, student_id, active=False)
+            if self._set(db, student_id, ExamStudentStats.ended.is_(False), ended=True):
+                self._increment(db, {"sessions_ended": 1})
+            if terminated and self._set(db, student_id, ExamStudentStats.terminated.is_(False), terminated=True):
+                self._increment(db, {"terminated": 1})
+            db.commit()
+
+    def violation(self, student_id: str, reason: str):
+        now = time.time()
+        with SessionLocal() as db:
+            counts = {"violations_total": 1, f"violations:{reason}": 1}
+            flagged = db.execute(insert(ExamFlaggedStudent).values(
+                exam_id=self.exam_id, reason=reason, student_id=student_id,
+            ).on_conflict_do_nothing()).rowcount > 0
+            if flagged:
+                counts[f"flagged:{reason}"] = 1
+            if self._set(db, student_id, ExamStudentStats.first_violation_at.is_(None), first_violation_at=now):
+                started_at = db.scalar(select(ExamStudentStats.started_at).where(self._student(student_id)))
+                bucket = next((i for i, bound in enumerate(FIRST_VIOLATION_BUCKETS)
+                               if now - started_at <= bound), len(FIRST_VIOLATION_BUCKETS))
+                counts["students_flagged"] = 1
+                counts[f"first_violation:{bucket}"] = 1
+            self._increment(db, counts)
+            db.commit()
+
+    def to_dict(self) -> Dict:
+        with SessionLocal() as db:
+            counters = dict(db.execute(select(ExamStatCounter.name, ExamStatCounter.value)
+                                       .where(ExamStatCounter.exam_id == self.exam_id)).all())
+            active_sessions = db.scalar(select(func.count()).select_from(ExamStudentStats).where(
+                ExamStudentStats.exam_id == self.exam_id,
+                ExamStudentStats.active.is_(True),
+                ExamStudentStats.seen_at >= time.time() - LIVE_SESSION_TIMEOUT,
+            ))
+
+        def by_prefix(prefix: str) -> Dict[str, int]:
+            return {name[len(prefix):]: value for name, value in counters.items()
+                    if name.startswith(prefix) and value}
+
+        labels = [f"<={bound}s" for bound in FIRST_VIOLATION_BUCKETS] + [f">{FIRST_VIOLATION_BUCKETS[-1]}s"]
+        sessions_ended = counters.get("sessions_ended", 0)
+        terminated = counters.get("terminated", 0)
+        return {
+            "exam_id": self.exam_id,
+            "active_sessions": active_sessions,
+            "sessions_started": counters.get("sessions_started", 0),
+            "sessions_ended": sessions_ended,
+            "terminated": terminated,
+            "termination_rate": terminated / sessions_ended if sessions_ended else 0.0,
+            "students_flagged": counters.get("students_flagged", 0),
+            "violations_total": counters.get("violations_total", 0),
+            "violations_by_reason": by_prefix("violations:"),
+            "students_flagged_by_reason": by_prefix("flagged:"),
+            "time_to_first_violation": {label: counters.get(f"first_violation:{i}", 0)
+                                        for i, label in enumerate(labels)},
+        }
+
+
+def get_exam_stats(exam_id: str) -> ExamStats:
+    return ExamStats(exam_id)
+
+
+def _record(event: str, exam_id: str, *args):
+    """Analytics are best effort, a database error never interrupts monitoring"""
+    try:
+        getattr(ExamStats(exam_id), event)(*args)
+    except SQLAlchemyError as e:
+        logger.error(f"Could not record {event} for exam {exam_id}: {e}")
+
+
+def session_started(exam_id: str, student_id: str):
+    _record("session_started", exam_id, student_id)
+
+
+def session_seen(exam_id: str, student_id: str):
+    _record("session_seen", exam_id, student_id)
+
+
+def session_drained(exam_id: str, student_id: str):
+    _record("session_drained", exam_id, student_id)
+
+
+def session_ended(exam_id: str, student_id: str, terminated: bool = False):
+    _record("session_ended", exam_id, student_id, terminated)
+
+
+def record_violation(exam_id: str, student_id: str, reason: str):
+    _record("violation", exam_id, student_id, reason)
@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+import secrets
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = Path("checkpoints")
+CHECKPOINT_TTL = int(os.getenv("EXAMLYZER_CHECKPOINT_TTL", "600"))  # Seconds a resume token stays valid
+
+# Set when the worker starts draining, new sessions are refused from then on
+draining = False
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def _checkpoint_path(token: str) -> Path:
+    return CHECKPOINT_DIR / f"{Path(token).name}.json"
+
+
+def write_checkpoints(checkpoints: Dict[str, Dict]):
+    """Write one compact JSON file per resume token; blocking, run it in a thread"""
+    CHECKPOINT_DIR.mkdir(exist_ok=True)
+    for token, state in checkpoints.items():
+        path = _checkpoint_path(token)
+        temp_path = path.with_suffix(".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+        # Rename so a restoring worker never reads a half-written checkpoint
+        os.replace(temp_path, path)
+
+
+def load_checkpoint(token: str, student_id: str, exam_id: str) -> Optional[Dict]:
+    """Read and consume a checkpoint, None if it is missing, expired or for another session"""
+    path = _checkpoint_path(token)
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get("student_id") != student_id or state.get("exam_id") != exam_id:
+        logger.warning(f"Resume token for {state.get('student_id')}/{state.get('exam_id')} "
+                       f"used by {student_id}/{exam_id}")
+        return None
+    path.unlink(missing_ok=True)
+    if time.time() - state.get("created_at", 0) > CHECKPOINT_TTL:
+        return None
+    return state
+
+
+def remove_expired():
+    """Drop checkpoints nobody came back for"""
+    if not CHECKPOINT_DIR.exists():
+        return
+    cutoff = time.time() - CHECKPOINT_TTL
+    for path in CHECKPOINT_DIR.glob("*.json"):
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ..lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+EVIDENCE_DIR = Path("evidence")
+# Served by routes/reports.py
+EVIDENCE_URL_PREFIX = "/api/reports/evidence"
+
+PRE_FRAMES = 3   # Frames kept from before the violation
+POST_FRAMES = 3  # Frames collected after the violation
+# Per session; only the last PRE_FRAMES frames are kept, this caps them when frames are unusually large
+RING_BUFFER_BYTES = int(os.getenv("EXAMLYZER_EVIDENCE_BUFFER_BYTES", str(1024 * 1024)))
+MAX_EXAM_EVIDENCE_BYTES = int(os.getenv("EXAMLYZER_EVIDENCE_MAX_BYTES", str(200 * 1024 * 1024)))  # Per exam
+MAX_PENDING_CLIPS = 4
+CLIP_FRAME_WIDTH = 240
+CLIP_JPEG_QUALITY = 40
+
+
+class FrameRingBuffer:
+    """Most recent encoded frames, bounded by count and by total size"""
+
+    def __init__(self, max_frames: int = PRE_FRAMES, max_bytes: int = RING_BUFFER_BYTES):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frames: Deque[bytes] = deque()
+        self.total_bytes = 0
+
+    def push(self, frame: bytes):
+        if len(frame) > self.max_bytes:
+            return
+        self.frames.append(frame)
+        self.total_bytes += len(frame)
+        while len(self.frames) > self.max_frames or self.total_bytes > self.max_bytes:
+            self.total_bytes -= len(self.frames.popleft())
+
+    def last(self, n: int) -> List[bytes]:
+        return list(self.frames)[-n:] if n > 0 else []
+
+    def clear(self):
+        self.frames.clear()
+        self.total_bytes = 0
+
+
+def evidence_url(exam_id: str, filename: str) -> str:
+    return f"{EVIDENCE_URL_PREFIX}/{Path(exam_id).name}/{Path(filename).name}"
+
+
+def evidence_file(url: str) -> Optional[Path]:
+    """Where an evidence URL from a violation record lives on disk"""
+    if not url or not url.startswith(EVIDENCE_URL_PREFIX + "/"):
+        return None
+    exam_id, _, filename = url[len(EVIDENCE_URL_PREFIX) + 1:].partition("/")
+    return EVIDENCE_DIR / Path(exam_id).name / Path(filename).name
+
+
+def encode_clip(frames: List[bytes]) -> Optional[bytes]:
+    """Decode the frames, shrink them and tile them into one low quality JPEG strip"""
+    tiles = []
+    for frame in frames:
+        image = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            continue
+        scale = CLIP_FRAME_WIDTH / image.shape[1]
+        tiles.append(cv2.resize(image, (CLIP_FRAME_WIDTH, max(1, int(image.shape[0] * scale))),
+                                interpolation=cv2.INTER_AREA))
+    if not tiles:
+        return None
+    height = min(tile.shape[0] for tile in tiles)
+    strip = np.hstack([tile[:height] for tile in tiles])
+    ok, encoded = cv2.imencode(".jpg", strip, [cv2.IMWRITE_JPEG_QUALITY, CLIP_JPEG_QUALITY])
+    return encoded.tobytes() if ok else None
+
+
+class EvidenceStore:
+    """Writes evidence files and keeps each exam's evidence under a disk budget"""
+
+    def __init__(self, max_exam_bytes: int = MAX_EXAM_EVIDENCE_BYTES):
+        self.max_exam_bytes = max_exam_bytes
+        # exam_id -> (path -> size), oldest first
+        self._files: Dict[str, "OrderedDict[Path, int]"] = {}
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def exam_dir(self, exam_id: str) -> Path:
+        return EVIDENCE_DIR / Path(exam_id).name
+
+    def _index(self, exam_id: str) -> "OrderedDict[Path, int]":
+        files = self._files.get(exam_id)
+        if files is None:
+            # Pick up evidence written before a restart
+            files = OrderedDict()
+            exam_dir = self.exam_dir(exam_id)
+            if exam_dir.exists():
+                for path in sorted(exam_dir.glob("*.jpg"), key=lambda p: p.stat().st_mtime):
+                    files[path] = path.stat().st_size
+            self._files[exam_id] = files
+            self._sizes[exam_id] = sum(files.values())
+        return files
+
+    def write(self, exam_id: str, path: Path, data: bytes):
+        """Blocking write, meant to run in a worker thread"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+        with self._lock:
+            self._account(exam_id, path, len(data))
+
+    def _account(self, exam_id: str, path: Path, size: int):
+        files = self._index(exam_id)
+        files[path] = size
+        self._sizes[exam_id] += size
+
+        while self._sizes[exam_id] > self.max_exam_bytes and len(files) > 1:
+            oldest, size = files.popitem(last=False)
+            self._sizes[exam_id] -= size
+            try:
+                oldest.unlink()
+                logger.info(f"Evicted evidence {oldest} to stay under the exam disk budget")
+            except FileNotFoundError:
+                pass
+
+    def usage(self, exam_id: str) -> int:
+        with self._lock:
+            self._index(exam_id)
+            return self._sizes[exam_id]
+
+
+class EvidenceRecorder:
+    """Per-session frame buffer that turns violations into evidence clips"""
+
+    def __init__(self, exam_id: str, student_id: str, store: "EvidenceStore" = None):
+        self.exam_id = exam_id
+        self.student_id = student_id
+        self.store = store or evidence_store
+        self.buffer = FrameRingBuffer()
+        # Clips still collecting post-violation frames: (path, frames, frames still needed)
+        self.pending: List[Tuple[Path, List[bytes], int]] = []
+        self.tasks = set()
+
+    def push(self, frame: bytes):
+        self.buffer.push(frame)
+        still_pending = []
+        for path, frames, remaining in self.pending:
+            frames.append(frame)
+            if remaining > 1:
+                still_pending.append((path, frames, remaining - 1))
+            else:
+                self._save(path, frames)
+        self.pending = still_pending
+
+    def capture(self, reason: str) -> Optional[str]:
+        """Start a clip for a violation and return the URL it will be served from"""
+        if len(self.pending) >= MAX_PENDING_CLIPS:
+            return None
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        slug = "".join(c if c.isalnum() else "_" for c in reason.lower())[:40]
+        path = self.store.exam_dir(self.exam_id) / f"{Path(self.student_id).name}_{timestamp}_{slug}.jpg"
+        self.pending.append((path, self.buffer.last(PRE_FRAMES), POST_FRAMES))
+        return evidence_url(self.exam_id, path.name)
+
+    def _save(self, path: Path, frames: List[bytes]):
+        task = asyncio.create_task(self._encode_and_write(path, frames))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _encode_and_write(self, path: Path, frames: List[bytes]):
+        try:
+            loop = asyncio.get_running_loop()
+            clip = await loop.run_in_executor(None, encode_clip, frames)
+            if clip is not None:
+                await asyncio.to_thread(self.store.write, self.exam_id, path, clip)
+        except Exception as e:
+            logger.error(f"Failed to save evidence {path}: {e}")
+
+    async def flush(self):
+        """Save pending clips with the frames collected so far and wait for all writes"""
+        for path, frames, _ in self.pending:
+            self._save(path, frames)
+        self.pending = []
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def close(self):
+        self.buffer.clear()
+
+
+# Global instance
+evidence_store = EvidenceStore()
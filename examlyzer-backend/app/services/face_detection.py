@@ -1,51 +1,62 @@
-import cv2
-import numpy as np
-from collections import deque
+import threading
 import time
+from typing import List, Tuple
+from ..lazy import lazy_import
+from .frame_filter import FrameChangeFilter
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+# detectMultiScale is not thread-safe, so cascades are never shared between threads:
+# every analysis thread holds its own pair and a detector uses the pair of the thread it runs on
+_thread_local = threading.local()
+# Built ahead of time by preload(), claimed by the first threads that need cascades
+_prebuilt: List[Tuple] = []
+_prebuilt_lock = threading.Lock()
+
+
+def _new_cascades() -> Tuple:
+    return (cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'),
+            cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml'))
+
 
 class CheatingDetector:
-    def __init__(self):
-        # Load Haar cascades for face and eye detection
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-        
-        # Movement detection parameters
+    @staticmethod
+    def load_cascades() -> Tuple:
+        """The calling thread's Haar cascades for face and eye detection"""
+        cascades = getattr(_thread_local, "cascades", None)
+        if cascades is None:
+            with _prebuilt_lock:
+                cascades = _prebuilt.pop() if _prebuilt else None
+            _thread_local.cascades = cascades = cascades or _new_cascades()
+        return cascades
+
+    def __init__(self, similarity_threshold: float = 2.0):
+        # Movement is measured against the previous analyzed frame
         self.prev_frame = None
-        self.movement_threshold = 500000  # Adjusted threshold for significant movement
-        self.movement_history = deque(maxlen=15)  # Using deque for efficient history tracking
-        self.stable_history = deque(maxlen=30)  # Track stability over longer period
         
         # Frame processing parameters
         self.resize_factor = 0.5  # Reduce processing load
         self.min_face_size = (100, 100)  # Minimum face size to consider
         
-        # Movement detection enhancements
-        self.consecutive_movement_frames = 0
-        self.consecutive_stable_frames = 0
-        self.movement_confirmation_threshold = 5  # Need 5 consecutive frames with movement
-        self.stability_confirmation_threshold = 10  # Need 10 stable frames to reset
-        
-        # Eye detection parameters
-        self.min_eye_detections = 1  # Minimum eyes to detect
-        self.eye_detection_failures = 0
-        self.max_eye_failures = 5  # Allowed consecutive eye detection failures
+        # Pre-filter: frames nearly identical to the last analyzed one reuse its result
+        self.frame_filter = FrameChangeFilter(threshold=similarity_threshold)
+        self.last_result = None
         
         # Performance tracking
         self.frame_count = 0
+        self.skipped_frames = 0
         self.start_time = time.time()
-        
-        # Cheating state tracking
-        self.cheating_state = {
-            'multiple_faces': False,
-            'no_face': False,
-            'no_eyes': False,
-            'excessive_movement': False
-        }
 
     def analyze_frame(self, image_data: bytes) -> dict:
+        """Measure the per-frame signals; deciding what counts as a violation is up to the exam's rules"""
         # Start frame processing timer
         frame_start_time = time.time()
         
+        # Skip detection entirely when the frame has not changed
+        if self.last_result is not None and self.frame_filter.is_unchanged_bytes(image_data):
+            return self._reuse_last_result(frame_start_time)
+        
         # Convert bytes to numpy array and decode image
         try:
             nparr = np.frombuffer(image_data, np.uint8)
@@ -53,11 +64,7 @@ class CheatingDetector:
             if img is None:
                 raise ValueError("Invalid image data")
         except Exception as e:
-            return {
-                "error": f"Image decoding failed: {str(e)}",
-                "is_cheating": False,
-                "reason": "Invalid frame"
-            }
+            return {"error": f"Image decoding failed: {str(e)}"}
         
         # Resize for faster processing
         img = cv2.resize(img, (0, 0), fx=self.resize_factor, fy=self.resize_factor)
@@ -68,8 +75,6 @@ class CheatingDetector:
         
         # Initialize results dictionary
         results = {
-            "is_cheating": False,
-            "reason": "",
             "details": {
                 "face_count": 0,
                 "eyes_detected": 0,
@@ -78,12 +83,14 @@ class CheatingDetector:
                 "processing_time": 0,
                 "fps": 0
             },
-            "warnings": []
+            "skipped": False
         }
 
         try:
+            face_cascade, eye_cascade = self.load_cascades()
+            
             # Face detection with optimized parameters
-            faces = self.face_cascade.detectMultiScale(
+            faces = face_cascade.detectMultiScale(
                 gray, 
                 scaleFactor=1.05,  # More sensitive scaling
                 minNeighbors=6,    # More strict neighbor count
@@ -92,115 +99,59 @@ class CheatingDetector:
             )
             results["details"]["face_count"] = len(faces)
             
-            # Multiple faces detection
-            if len(faces) > 1:
-                self.cheating_state['multiple_faces'] = True
-                results.update({
-                    "is_cheating": True,
-                    "reason": "Multiple faces detected",
-                })
-                results["warnings"].append(f"Detected {len(faces)} faces in frame")
-            else:
-                self.cheating_state['multiple_faces'] = False
-            
-            # No face detection
-            if len(faces) == 0:
-                self.cheating_state['no_face'] = True
-                results.update({
-                    "is_cheating": True,
-                    "reason": "No face detected",
-                })
-                results["warnings"].append("No face detected in frame")
-            else:
-                self.cheating_state['no_face'] = False
-                
+            if len(faces) > 0:
                 # Eye detection within the main face (largest face if multiple)
                 (x, y, w, h) = max(faces, key=lambda f: f[2]*f[3])  # Get largest face
                 roi_gray = gray[y:y+h, x:x+w]
                 
                 # Detect eyes with more stringent parameters
-                eyes = self.eye_cascade.detectMultiScale(
+                eyes = eye_cascade.detectMultiScale(
                     roi_gray,
                     scaleFactor=1.1,
                     minNeighbors=5,
                     minSize=(30, 30)
                 )
                 results["details"]["eyes_detected"] = len(eyes)
-                
-                # Eye detection failure tracking
-                if len(eyes) < self.min_eye_detections:
-                    self.eye_detection_failures += 1
-                    if self.eye_detection_failures >= self.max_eye_failures:
-                        self.cheating_state['no_eyes'] = True
-                        results.update({
-                            "is_cheating": True,
-                            "reason": "Eyes not detected consistently",
-                        })
-                        results["warnings"].append(f"Eye detection failed for {self.eye_detection_failures} consecutive frames")
-                else:
-                    self.eye_detection_failures = 0
-                    self.cheating_state['no_eyes'] = False
 
-            # Enhanced movement detection
+            # Movement relative to the previous frame
             if self.prev_frame is not None:
                 movement_level, movement_percentage = self.detect_movement(self.prev_frame, gray)
                 results["details"]["movement_level"] = movement_level
                 results["details"]["movement_percentage"] = movement_percentage
-                
-                # Update movement history
-                self.movement_history.append(movement_level)
-                self.stable_history.append(movement_level < self.movement_threshold)
-                
-                # Calculate smoothed movement using weighted average
-                weights = np.linspace(0.1, 1.0, len(self.movement_history))
-                avg_movement = np.average(list(self.movement_history), weights=weights)
-                
-                # Check for consecutive movement frames
-                if movement_level > self.movement_threshold:
-                    self.consecutive_movement_frames += 1
-                    self.consecutive_stable_frames = 0
-                else:
-                    self.consecutive_movement_frames = max(0, self.consecutive_movement_frames - 1)
-                    self.consecutive_stable_frames += 1
-                
-                # Only flag cheating if we have consistent movement
-                if (self.consecutive_movement_frames >= self.movement_confirmation_threshold and 
-                    avg_movement > self.movement_threshold):
-                    self.cheating_state['excessive_movement'] = True
-                    results.update({
-                        "is_cheating": True,
-                        "reason": "Excessive movement detected",
-                    })
-                    results["warnings"].append(f"Sustained movement over {self.consecutive_movement_frames} frames")
-                elif self.consecutive_stable_frames >= self.stability_confirmation_threshold:
-                    self.cheating_state['excessive_movement'] = False
 
             # Update previous frame
             self.prev_frame = gray.copy()
-            
-            # Determine overall cheating state
-            cheating_reasons = [k for k, v in self.cheating_state.items() if v]
-            if cheating_reasons:
-                results.update({
-                    "is_cheating": True,
-                    "reason": ", ".join(cheating_reasons)
-                })
 
             # Update frame count and calculate FPS
             self.frame_count += 1
             elapsed_time = time.time() - self.start_time
             results["details"]["fps"] = self.frame_count / elapsed_time if elapsed_time > 0 else 0
             
+            self.last_result = results
+            
         except Exception as e:
             print(f"Analysis error: {e}")
             results["error"] = str(e)
-            results["is_cheating"] = False  # Default to not cheating on error
         
         # Record processing time
         results["details"]["processing_time"] = time.time() - frame_start_time
         
         return results
 
+    def _reuse_last_result(self, frame_start_time: float) -> dict:
+        """Repeat the last analyzed frame's signals; an unchanged frame has no movement"""
+        results = {
+            "details": dict(self.last_result["details"], movement_level=0, movement_percentage=0.0),
+            "skipped": True
+        }
+        
+        self.frame_count += 1
+        self.skipped_frames += 1
+        elapsed_time = time.time() - self.start_time
+        results["details"]["fps"] = self.frame_count / elapsed_time if elapsed_time > 0 else 0
+        results["details"]["processing_time"] = time.time() - frame_start_time
+        return results
+
     def detect_movement(self, prev_frame, current_frame):
         # Compute absolute difference between frames
         diff = cv2.absdiff(prev_frame, current_frame)
@@ -234,20 +185,23 @@ class CheatingDetector:
     def reset(self):
         """Reset the detector's state between different videos or sessions"""
         self.prev_frame = None
-        self.movement_history.clear()
-        self.stable_history.clear()
-        self.consecutive_movement_frames = 0
-        self.consecutive_stable_frames = 0
-        self.eye_detection_failures = 0
+        self.frame_filter.reset()
+        self.last_result = None
         self.frame_count = 0
+        self.skipped_frames = 0
         self.start_time = time.time()
-        self.cheating_state = {
-            'multiple_faces': False,
-            'no_face': False,
-            'no_eyes': False,
-            'excessive_movement': False
-        }
         
+    def to_state(self) -> dict:
+        """Counters for checkpoints; cached frames are left out and rebuilt from the next frame"""
+        return {
+            "frame_count": self.frame_count,
+            "skipped_frames": self.skipped_frames
+        }
+
+    def load_state(self, state: dict):
+        self.frame_count = state["frame_count"]
+        self.skipped_frames = state["skipped_frames"]
+
     def get_performance_metrics(self):
         """Return performance metrics"""
         elapsed_time = time.time() - self.start_time
@@ -255,10 +209,19 @@ class CheatingDetector:
             "total_frames": self.frame_count,
             "elapsed_time": elapsed_time,
             "fps": self.frame_count / elapsed_time if elapsed_time > 0 else 0,
-            "movement_history": list(self.movement_history),
-            "current_state": self.cheating_state
+            "skipped_frames": self.skipped_frames,
+            "skip_ratio": self.skipped_frames / self.frame_count if self.frame_count else 0.0
         }
 
 
-# Global instance
-cheating_detector = CheatingDetector()
\ No newline at end of file
+def preload(threads: int = 1):
+    """Load a pair of Haar cascades for every analysis thread before the first session needs them.
+
+    The inline analysis pool claims them as its threads start, and when this
+    runs before a fork (EXAMLYZER_PRELOAD=1) every worker inherits them loaded.
+    """
+    with _prebuilt_lock:
+        missing = threads - len(_prebuilt)
+    cascades = [_new_cascades() for _ in range(missing)]
+    with _prebuilt_lock:
+        _prebuilt.extend(cascades)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import Optional
+from ..lazy import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+
+class FrameChangeFilter:
+    """Detects frames that are nearly identical to the previous one.
+
+    Frames are reduced to a tiny grayscale thumbnail and compared with the
+    last thumbnail that was accepted, so the check costs far less than the
+    detection it guards.
+    """
+
+    def __init__(self, threshold: float = 2.0, thumbnail_size: int = 32):
+        self.threshold = threshold  # Mean absolute pixel difference (0-255)
+        self.thumbnail_size = thumbnail_size
+        self.prev_thumbnail: Optional[np.ndarray] = None
+
+    def thumbnail(self, image: np.ndarray) -> np.ndarray:
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(image, (self.thumbnail_size, self.thumbnail_size),
+                          interpolation=cv2.INTER_AREA)
+
+    def thumbnail_from_bytes(self, image_data: bytes) -> Optional[np.ndarray]:
+        """Decode an encoded frame at 1/8 scale, straight to grayscale.
+
+        JPEG decoders can skip most of the IDCT work at reduced scales, so this
+        is much cheaper than a full decode followed by a resize.
+        """
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if image is None:
+            return None
+        return self.thumbnail(image)
+
+    def difference(self, thumbnail: np.ndarray) -> float:
+        if self.prev_thumbnail is None:
+            return float("inf")
+        return float(cv2.absdiff(self.prev_thumbnail, thumbnail).mean())
+
+    def _compare(self, thumbnail: Optional[np.ndarray]) -> bool:
+        if thumbnail is None:
+            return False
+        if self.difference(thumbnail) < self.threshold:
+            return True
+        self.prev_thumbnail = thumbnail
+        return False
+
+    def is_unchanged(self, image: np.ndarray) -> bool:
+        """Return True if the frame can reuse the previous result"""
+        return self._compare(self.thumbnail(image))
+
+    def is_unchanged_bytes(self, image_data: bytes) -> bool:
+        """Same as is_unchanged, but works on the encoded frame"""
+        return self._compare(self.thumbnail_from_bytes(image_data))
+
+    def reset(self):
+        self.prev_thumbnail = None
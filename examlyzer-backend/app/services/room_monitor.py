@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+import httpx
+
+from ..lazy import lazy_import
+from .frame_filter import FrameChangeFilter
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Default ESP32 snapshot camera, used when no room cameras are configured
+ESP32_CAM_URL = "http://192.168.137.216/cam-hi.jpg"
+
+
+def parse_room_cameras(value: Optional[str]) -> Dict[str, str]:
+    """Parse "room1=http://cam1/jpg,room2=http://cam2/stream" into a dict"""
+    cameras = {}
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition("=")
+        if not sep:
+            name, url = f"camera{len(cameras) + 1}", item
+        cameras[name.strip()] = url.strip()
+    return cameras
+
+
+# Room cameras to monitor, configured through EXAMLYZER_ROOM_CAMERAS.
+# Snapshot URLs are polled, MJPEG (multipart/x-mixed-replace) URLs are streamed.
+ROOM_CAMERAS = parse_room_cameras(os.getenv("EXAMLYZER_ROOM_CAMERAS")) or {"default": ESP32_CAM_URL}
+POLL_INTERVAL = float(os.getenv("EXAMLYZER_CAMERA_POLL_INTERVAL", "2.0"))
+FETCH_TIMEOUT = float(os.getenv("EXAMLYZER_CAMERA_TIMEOUT", "5.0"))
+MAX_DETECTION_FPS = float(os.getenv("EXAMLYZER_CAMERA_MAX_FPS", "2.0"))  # Per camera
+DETECTION_WORKERS = int(os.getenv("EXAMLYZER_DETECTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+DETECTION_WIDTH = int(os.getenv("EXAMLYZER_DETECTION_WIDTH", "640"))
+MAX_PEOPLE_PER_ROOM = int(os.getenv("EXAMLYZER_ROOM_MAX_PEOPLE", "0"))  # 0 disables the alert
+
+# Optional MobileNet-SSD model, HOG + SVM is used when it is not configured
+DNN_PROTOTXT = os.getenv("EXAMLYZER_PEOPLE_DNN_CONFIG")
+DNN_MODEL = os.getenv("EXAMLYZER_PEOPLE_DNN_MODEL")
+DNN_PERSON_CLASS = 15
+DNN_CONFIDENCE = 0.5
+
+RECONNECT_DELAY = 2.0
+MAX_STREAM_BUFFER = 4 * 1024 * 1024
+
+
+_people_svm = None
+
+
+def default_people_svm():
+    """Coefficients of OpenCV's default people detector, fetched once per process"""
+    global _people_svm
+    if _people_svm is None:
+        _people_svm = cv2.HOGDescriptor_getDefaultPeopleDetector()
+    return _people_svm
+
+
+class PeopleDetector:
+    def __init__(self):
+        self.net = None
+        if DNN_PROTOTXT and DNN_MODEL:
+            self.net = cv2.dnn.readNetFromCaffe(DNN_PROTOTXT, DNN_MODEL)
+        else:
+            # Build the HOG descriptor once, setting the SVM detector is expensive
+            self.hog = cv2.HOGDescriptor()
+            self.hog.setSVMDetector(default_people_svm())
+
+    @staticmethod
+    def decode(image_data: bytes) -> np.ndarray:
+        image_array = np.frombuffer(image_data, np.uint8)
+        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Invalid image data")
+        return image
+
+    @staticmethod
+    def downscale(image: np.ndarray, width: int = DETECTION_WIDTH) -> np.ndarray:
+        if width <= 0 or image.shape[1] <= width:
+            return image
+        scale = width / image.shape[1]
+        return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    def detect(self, image: np.ndarray) -> int:
+        if self.net is not None:
+            blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 0.007843, (300, 300), 127.5)
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+            return int(np.sum((detections[:, 1] == DNN_PERSON_CLASS) &
+                              (detections[:, 2] >= DNN_CONFIDENCE)))
+        boxes, _ = self.hog.detectMultiScale(image, winStride=(8, 8))
+        return len(boxes)
+
+    def count(self, image_data: bytes) -> int:
+        return self.detect(self.downscale(self.decode(image_data)))
+
+
+# Detectors are not shared between threads, every pool worker holds its own
+_thread_local = threading.local()
+# Built ahead of time by preload(), claimed by the first threads that need a detector
+_prebuilt: List[PeopleDetector] = []
+_prebuilt_lock = threading.Lock()
+
+
+def get_people_detector() -> PeopleDetector:
+    detector = getattr(_thread_local, "detector", None)
+    if detector is None:
+        with _prebuilt_lock:
+            detector = _prebuilt.pop() if _prebuilt else None
+        _thread_local.detector = detector = detector or PeopleDetector()
+    return detector
+
+
+def preload(workers: int = DETECTION_WORKERS):
+    """Build a detector for every detection thread before the first camera frame arrives.
+
+    The detection pool claims them as its threads start, and when this runs
+    before a fork (EXAMLYZER_PRELOAD=1) every worker inherits them built.
+    """
+    with _prebuilt_lock:
+        missing = workers - len(_prebuilt)
+    detectors = [PeopleDetector() for _ in range(missing)]
+    with _prebuilt_lock:
+        _prebuilt.extend(detectors)
+
+
+def iter_jpeg_frames(buffer: bytearray):
+    """Pop every complete JPEG out of an MJPEG byte buffer"""
+    while True:
+        start = buffer.find(b"\xff\xd8")
+        if start < 0:
+            # Keep a trailing 0xFF in case the marker was split between chunks
+            del buffer[:max(0, len(buffer) - 1)]
+            return
+        end = buffer.find(b"\xff\xd9", start + 2)
+        if end < 0:
+            del buffer[:start]
+            return
+        frame = bytes(buffer[start:end + 2])
+        del buffer[:end + 2]
+        yield frame
+
+
+@dataclass
+class CameraState:
+    name: str
+    url: str
+    mode: str = "pending"
+    people_count: Optional[int] = None
+    status: str = "pending"
+    error: Optional[str] = None
+    updated_at: Optional[float] = None
+    last_detection: float = 0.0
+    frames_received: int = 0
+    frames_detected: int = 0
+    frames_unchanged: int = 0
+    frames_rate_limited: int = 0
+    alert_active: bool = False
+
+    def snapshot(self) -> Dict:
+        return {
+            "camera": self.name,
+            "mode": self.mode,
+            "people_count": self.people_count,
+            "status": self.status,
+            "error": self.error,
+            "updated_at": self.updated_at,
+            "frames_received": self.frames_received,
+            "frames_detected": self.frames_detected,
+            "frames_unchanged": self.frames_unchanged,
+            "frames_rate_limited": self.frames_rate_limited,
+        }
+
+
+class RoomMonitor:
+    """Keeps the latest people count for every configured room camera.
+
+    Each camera gets its own reader task (snapshot polling or MJPEG
+    streaming). Readers hand frames to a shared detection pool; frames that
+    arrive faster than the per-camera rate limit, or that have not changed
+    since the last detection, never reach the pool.
+    """
+
+    def __init__(self, cameras: Dict[str, str], interval: float = POLL_INTERVAL,
+                 timeout: float = FETCH_TIMEOUT, max_fps: float = MAX_DETECTION_FPS,
+                 workers: int = DETECTION_WORKERS, max_people: int = MAX_PEOPLE_PER_ROOM):
+        self.cameras = dict(cameras)
+        self.interval = interval
+        self.timeout = timeout
+        self.min_detection_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.workers = max(1, workers)
+        self.max_people = max_people
+        self.states = {name: CameraState(name, url) for name, url in self.cameras.items()}
+        self.filters = {name: FrameChangeFilter() for name in self.cameras}
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.client: Optional[httpx.AsyncClient] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        if self._tasks:
+            return
+        # One pooled client for every camera, connections are kept alive between polls.
+        # The read timeout is per chunk, so it also catches MJPEG streams that stall.
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max(len(self.cameras), 1) * 2,
+                                max_keepalive_connections=max(len(self.cameras), 1)),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="room-detect",
+                                           initializer=get_people_detector)
+        self._slots = asyncio.Semaphore(self.workers)
+        for name in self.cameras:
+            self._tasks[name] = asyncio.create_task(self._run_camera(name))
+        logger.info(f"Started monitoring {len(self.cameras)} room camera(s) "
+                    f"with {self.workers} detection worker(s)")
+
+    async def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    # Publishing
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, message: Dict):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Slow subscriber, drop its oldest message rather than block the cameras
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    # Detection
+
+    def _decode_and_compare(self, name: str, image_data: bytes):
+        image = PeopleDetector.decode(image_data)
+        return image, self.filters[name].is_unchanged(image)
+
+    async def _detect(self, name: str, image_data: bytes) -> Optional[int]:
+        """Run detection for one frame, None means the frame was skipped"""
+        state = self.states[name]
+        now = time.monotonic()
+        if now - state.last_detection < self.min_detection_interval:
+            state.frames_rate_limited += 1
+            return None
+
+        image, unchanged = await asyncio.to_thread(self._decode_and_compare, name, image_data)
+        if state.people_count is not None and unchanged:
+            state.frames_unchanged += 1
+            state.last_detection = now
+            return state.people_count
+
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            people_count = await loop.run_in_executor(
+                self.executor, lambda: get_people_detector().detect(PeopleDetector.downscale(image))
+            )
+        state.frames_detected += 1
+        state.last_detection = time.monotonic()
+        return people_count
+
+    async def handle_frame(self, name: str, image_data: bytes):
+        state = self.states[name]
+        state.frames_received += 1
+        try:
+            people_count = await self._detect(name, image_data)
+        except Exception as e:
+            self._set_failed(name, e)
+            return
+        if people_count is None:
+            return
+
+        changed = people_count != state.people_count or state.status != "success"
+        state.people_count = people_count
+        state.status = "success"
+        state.error = None
+        state.updated_at = time.time()
+        if changed:
+            self.publish({"type": "people_count", **state.snapshot()})
+        self._check_alert(state)
+
+    def _check_alert(self, state: CameraState):
+        if self.max_people <= 0:
+            return
+        over_limit = state.people_count > self.max_people
+        if over_limit and not state.alert_active:
+            self.publish({
+                "type": "alert",
+                "camera": state.name,
+                "message": f"{state.people_count} people detected, expected at most {self.max_people}",
+                "people_count": state.people_count,
+                "timestamp": state.updated_at,
+            })
+        state.alert_active = over_limit
+
+    def _set_failed(self, name: str, error: Exception):
+        state = self.states[name]
+        was_failing = state.status == "failed"
+        state.status = "failed"
+        state.error = str(error)
+        if not was_failing:
+            logger.warning(f"Room camera {name} failed: {error}")
+            self.publish({"type": "camera_error", **state.snapshot()})
+
+    # Camera readers
+
+    async def fetch(self, url: str) -> bytes:
+        response = await self.client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    async def poll_camera(self, name: str) -> Dict:
+        """Fetch one snapshot and update the cached count for the camera"""
+        try:
+            image_data = await self.fetch(self.cameras[name])
+        except Exception as e:
+            self._set_failed(name, e)
+        else:
+            await self.handle_frame(name, image_data)
+        return self.get(name)
+
+    async def _run_camera(self, name: str):
+        url = self.cameras[name]
+        state = self.states[name]
+        while True:
+            try:
+                async with self.client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get("content-type", "")
+                    if content_type.startswith("multipart/"):
+                        state.mode = "mjpeg"
+                        await self._read_stream(name, response)
+                        continue
+                    state.mode = "snapshot"
+                    image_data = await response.aread()
+                started = time.monotonic()
+                await self.handle_frame(name, image_data)
+                await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._set_failed(name, e)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _read_stream(self, name: str, response: httpx.Response):
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes():
+            buffer.extend(chunk)
+            if len(buffer) > MAX_STREAM_BUFFER:
+                raise ValueError("MJPEG stream produced an oversized frame")
+            frames = list(iter_jpeg_frames(buffer))
+            if frames:
+                # Only the newest frame matters, older ones would be stale by now
+                await self.handle_frame(name, frames[-1])
+        raise ConnectionError("MJPEG stream ended")
+
+    def get(self, name: str) -> Optional[Dict]:
+        state = self.states.get(name)
+        if state is None or state.status == "pending":
+            return None
+        return state.snapshot()
+
+
+# Global instance
+room_monitor = RoomMonitor(ROOM_CAMERAS)
@@ -0,0 +1,185 @@
+import json
+import logging
+import operator
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..schemas import ExamRulesConfig
+
+logger = logging.getLogger(__name__)
+
+EXAM_RULES_DIR = Path("exam_rules")
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+SIGNALS = {"face_count", "eyes_detected", "movement_level", "movement_percentage"}
+
+DEFAULT_EXAM_RULES = {
+    "max_violations": 3,
+    "rules": [
+        {
+            "name": "multiple_faces",
+            "reason": "Multiple faces detected",
+            "when": [{"signal": "face_count", "op": ">", "value": 1}],
+            "duration": 0.5,
+        },
+        {
+            "name": "no_face",
+            "reason": "No face detected",
+            "when": [{"signal": "face_count", "op": "==", "value": 0}],
+            "duration": 2.0,
+        },
+        {
+            "name": "no_eyes",
+            "reason": "Eyes not detected consistently",
+            "when": [
+                {"signal": "face_count", "op": ">", "value": 0},
+                {"signal": "eyes_detected", "op": "<", "value": 1},
+            ],
+            "duration": 2.0,
+        },
+        {
+            "name": "excessive_movement",
+            "reason": "Excessive movement detected",
+            "when": [{"signal": "movement_level", "op": ">", "value": 500000}],
+            "duration": 2.0,
+        },
+    ],
+}
+
+
+class CompiledRule:
+    """A rule with its conditions resolved to (signal, operator, value) tuples"""
+
+    def __init__(self, config):
+        for condition in config.when:
+            if condition.signal not in SIGNALS:
+                raise ValueError(f"Unknown signal '{condition.signal}' in rule {config.name}")
+            if condition.op not in OPERATORS:
+                raise ValueError(f"Unknown operator '{condition.op}' in rule {config.name}")
+        self.name = config.name
+        self.reason = config.reason
+        self.conditions = [(c.signal, OPERATORS[c.op], c.value) for c in config.when]
+        self.duration = config.duration
+        self.debounce = config.debounce
+        self.cooldown = config.cooldown
+        self.severity = config.severity
+
+    def matches(self, details: Dict) -> bool:
+        return all(op(details.get(signal, 0), value) for signal, op, value in self.conditions)
+
+
+class RuleState:
+    __slots__ = ("active_since", "last_held", "armed", "last_fired")
+
+    def __init__(self):
+        self.active_since: Optional[float] = None  # Start of the current episode
+        self.last_held: Optional[float] = None
+        self.armed = True  # False once the current episode has fired
+        self.last_fired: Optional[float] = None
+
+
+class CompiledExamRules:
+    def __init__(self, config: ExamRulesConfig):
+        self.config = config
+        self.max_violations = config.max_violations
+        self.rules = [CompiledRule(rule) for rule in config.rules]
+
+    def new_engine(self) -> "RulesEngine":
+        return RulesEngine(self)
+
+
+class RulesEngine:
+    """Evaluates an exam's rules incrementally over one session's frames.
+
+    A rule fires once when its conditions have held for `duration`, then
+    stays quiet until they have been clear for `debounce` and `cooldown`
+    has passed since the last event. Sticky detector states therefore
+    produce one event per episode instead of one per frame.
+    """
+
+    def __init__(self, compiled: CompiledExamRules):
+        self.compiled = compiled
+        self.states = [RuleState() for _ in compiled.rules]
+
+    @property
+    def max_violations(self) -> int:
+        return self.compiled.max_violations
+
+    def to_state(self) -> List[list]:
+        return [[s.active_since, s.last_held, s.armed, s.last_fired] for s in self.states]
+
+    def load_state(self, state: List[list]):
+        # Rules may have changed since the checkpoint, only restore matching positions
+        for rule_state, values in zip(self.states, state):
+            rule_state.active_since, rule_state.last_held, rule_state.armed, rule_state.last_fired = values
+
+    def evaluate(self, details: Dict, now: Optional[float] = None) -> List[Dict]:
+        now = time.time() if now is None else now
+        events = []
+        for rule, state in zip(self.compiled.rules, self.states):
+            if rule.matches(details):
+                state.last_held = now
+                if state.active_since is None:
+                    state.active_since = now
+                if (state.armed and now - state.active_since >= rule.duration and
+                        (state.last_fired is None or now - state.last_fired >= rule.cooldown)):
+                    state.armed = False
+                    state.last_fired = now
+                    events.append({
+                        "rule": rule.name,
+                        "reason": rule.reason,
+                        "severity": rule.severity,
+                        "held_for": now - state.active_since,
+                    })
+            elif state.active_since is not None and now - state.last_held >= rule.debounce:
+                # Episode is over, the rule may fire again next time
+                state.active_since = None
+                state.armed = True
+        return events
+
+
+_compiled_cache: Dict[str, CompiledExamRules] = {}
+
+
+def _rules_path(exam_id: str) -> Path:
+    return EXAM_RULES_DIR / f"{Path(exam_id).name}.json"
+
+
+def get_exam_rules(exam_id: str) -> CompiledExamRules:
+    """Compiled rules for an exam, falling back to the defaults"""
+    compiled = _compiled_cache.get(exam_id)
+    if compiled is None:
+        path = _rules_path(exam_id)
+        config = ExamRulesConfig(**DEFAULT_EXAM_RULES)
+        if path.exists():
+            try:
+                with open(path, "r") as f:
+                    config = ExamRulesConfig(**json.load(f))
+            except Exception as e:
+                logger.error(f"Invalid rules for exam {exam_id}, using defaults: {e}")
+        compiled = _compiled_cache[exam_id] = CompiledExamRules(config)
+    return compiled
+
+
+def set_exam_rules(exam_id: str, config: ExamRulesConfig) -> CompiledExamRules:
+    """Validate, save and cache an exam's rules; running sessions keep their old rules"""
+    compiled = CompiledExamRules(config)
+    with open(_rules_path(exam_id), "w") as f:
+        json.dump(config.model_dump(), f, indent=2)
+    _compiled_cache[exam_id] = compiled
+    return compiled
+
+
+def reset_exam_rules(exam_id: str):
+    path = _rules_path(exam_id)
+    if path.exists():
+        path.unlink()
+    _compiled_cache.pop(exam_id, None)
@@ -0,0 +1,209 @@
+import logging
+import struct
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SIGNALS_DIR = Path("signals")
+
+# Rollup resolutions in seconds, computed as frames arrive
+RESOLUTIONS = {"1s": 1, "10s": 10, "1m": 60}
+FLUSH_EVERY = 512  # Frames buffered in memory before a chunk is appended to disk
+
+# Chunk layout: header, then one column after another
+#   magic (4s) | frame count (I) | t (d * n) | face_count (B * n) | eyes_detected (B * n) | movement_percentage (f * n)
+CHUNK_MAGIC = b"SIG1"
+CHUNK_HEADER = struct.Struct("<4sI")
+
+
+class Rollup:
+    """Fixed-size time buckets over the per-frame signals, kept as columns"""
+
+    COLUMNS = ("face_count_mean", "face_count_max", "eyes_detected_mean",
+               "movement_percentage_mean", "movement_percentage_max")
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        self.t = array("d")
+        self.count = array("I")
+        self.columns = {name: array("f") for name in self.COLUMNS}
+        self._bucket: Optional[float] = None
+        self._reset_accumulator()
+
+    def _reset_accumulator(self):
+        self._n = 0
+        self._face_sum = 0
+        self._face_max = 0
+        self._eyes_sum = 0
+        self._movement_sum = 0.0
+        self._movement_max = 0.0
+
+    def _close_bucket(self):
+        if self._n == 0:
+            return
+        self.t.append(self._bucket)
+        self.count.append(self._n)
+        for name, value in self._current_values().items():
+            self.columns[name].append(value)
+        self._reset_accumulator()
+
+    def _current_values(self) -> Dict[str, float]:
+        return {
+            "face_count_mean": self._face_sum / self._n,
+            "face_count_max": self._face_max,
+            "eyes_detected_mean": self._eyes_sum / self._n,
+            "movement_percentage_mean": self._movement_sum / self._n,
+            "movement_percentage_max": self._movement_max,
+        }
+
+    def add(self, t: float, face_count: int, eyes_detected: int, movement_percentage: float):
+        bucket = t - (t % self.seconds)
+        if bucket != self._bucket:
+            self._close_bucket()
+            self._bucket = bucket
+        self._n += 1
+        self._face_sum += face_count
+        self._face_max = max(self._face_max, face_count)
+        self._eyes_sum += eyes_detected
+        self._movement_sum += movement_percentage
+        self._movement_max = max(self._movement_max, movement_percentage)
+
+    def __len__(self) -> int:
+        return len(self.t) + (1 if self._n else 0)
+
+    def to_dict(self) -> Dict:
+        """Closed buckets plus the one still filling up"""
+        data = {"t": self.t.tolist(), "count": self.count.tolist()}
+        data.update({name: column.tolist() for name, column in self.columns.items()})
+        if self._n:
+            data["t"].append(self._bucket)
+            data["count"].append(self._n)
+            for name, value in self._current_values().items():
+                data[name].append(value)
+        return data
+
+
+class SignalSeries:
+    """Per-session signal store: array-backed buffer flushed to an append-only chunk file"""
+
+    def __init__(self, exam_id: str, student_id: str):
+        self.path = series_path(exam_id, student_id)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._reset_buffer()
+        self.rollups = {name: Rollup(seconds) for name, seconds in RESOLUTIONS.items()}
+        if self.path.exists():
+            # A reconnecting (or resumed) session carries on from what it already recorded
+            try:
+                add_chunks(self.path, self.rollups.values())
+            except ValueError as e:
+                logger.error(f"Could not seed rollups from {self.path}: {e}")
+
+    def _reset_buffer(self):
+        self.t = array("d")
+        self.face_count = array("B")
+        self.eyes_detected = array("B")
+        self.movement_percentage = array("f")
+
+    def append(self, t: float, details: Dict):
+        face_count = min(int(details.get("face_count", 0)), 255)
+        eyes_detected = min(int(details.get("eyes_detected", 0)), 255)
+        movement_percentage = float(details.get("movement_percentage", 0.0))
+
+        self.t.append(t)
+        self.face_count.append(face_count)
+        self.eyes_detected.append(eyes_detected)
+        self.movement_percentage.append(movement_percentage)
+        for rollup in self.rollups.values():
+            rollup.add(t, face_count, eyes_detected, movement_percentage)
+
+        if len(self.t) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self.t:
+            return
+        with open(self.path, "ab") as f:
+            f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(self.t)))
+            for column in (self.t, self.face_count, self.eyes_detected, self.movement_percentage):
+                column.tofile(f)
+        self._reset_buffer()
+
+    def close(self):
+        self.flush()
+
+
+def series_path(exam_id: str, student_id: str) -> Path:
+    return SIGNALS_DIR / Path(exam_id).name / f"{Path(student_id).name}.bin"
+
+
+def read_chunks(path: Path) -> Iterator[Tuple[array, array, array, array]]:
+    """Yield the (t, face_count, eyes_detected, movement_percentage) columns of every chunk"""
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            magic, n = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"Corrupt signal chunk in {path}")
+            columns = (array("d"), array("B"), array("B"), array("f"))
+            try:
+                for column in columns:
+                    column.fromfile(f, n)
+            except EOFError:
+                # Partial chunk left by a crash mid-write
+                logger.warning(f"Truncated signal chunk in {path}")
+                return
+            yield columns
+
+
+def add_chunks(path: Path, rollups):
+    """Feed every frame stored in a chunk file into the given rollups"""
+    for t, face_count, eyes_detected, movement_percentage in read_chunks(path):
+        for row in zip(t, face_count, eyes_detected, movement_percentage):
+            for rollup in rollups:
+                rollup.add(*row)
+
+
+# Live sessions, keyed by (exam_id, student_id)
+active_series: Dict[Tuple[str, str], SignalSeries] = {}
+
+
+def open_series(exam_id: str, student_id: str) -> SignalSeries:
+    series = active_series.get((exam_id, student_id))
+    if series is None:
+        series = active_series[(exam_id, student_id)] = SignalSeries(exam_id, student_id)
+    return series
+
+
+def close_series(exam_id: str, student_id: str):
+    series = active_series.pop((exam_id, student_id), None)
+    if series is not None:
+        series.close()
+
+
+def get_timeline(exam_id: str, student_id: str, resolution: str) -> Optional[Dict]:
+    """Timeline at "raw" or one of RESOLUTIONS, None if nothing was recorded"""
+    series = active_series.get((exam_id, student_id))
+    if series is not None and resolution in RESOLUTIONS:
+        return series.rollups[resolution].to_dict()
+
+    path = series_path(exam_id, student_id)
+    if series is not None:
+        series.flush()
+    elif not path.exists():
+        return None
+
+    if resolution == "raw":
+        data = {"t": [], "face_count": [], "eyes_detected": [], "movement_percentage": []}
+        for columns in read_chunks(path):
+            for name, column in zip(data, columns):
+                data[name].extend(column.tolist())
+        return data
+
+    # Finished session: rebuild the rollup from the chunk file
+    rollup = Rollup(RESOLUTIONS[resolution])
+    add_chunks(path, [rollup])
+    return rollup.to_dict()
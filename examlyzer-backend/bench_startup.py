@@ -0,0 +1,77 @@
+"""Startup benchmark: time until a fresh worker answers its first request and reports ready.
+
+Run from examlyzer-backend/:
+
+    python bench_startup.py [--runs 5] [--preload]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, started: float, timeout: float, status: int = None) -> float:
+    """Seconds from `started` until `url` answers (with `status`, if given)"""
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                code = response.status
+        except urllib.error.HTTPError as e:
+            code = e.code
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.01)
+            continue
+        if status is None or code == status:
+            return time.perf_counter() - started
+        time.sleep(0.01)
+    raise TimeoutError(f"{url} not available after {timeout}s")
+
+
+def run_once(preload: bool, timeout: float):
+    port = free_port()
+    env = dict(os.environ, EXAMLYZER_PRELOAD="1" if preload else "0")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    try:
+        first_request = wait_for(f"http://127.0.0.1:{port}/health", started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", started, timeout, status=200)
+        return first_request, ready
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--preload", action="store_true", help="load models at import (EXAMLYZER_PRELOAD=1)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    first_requests, readies = [], []
+    for i in range(args.runs):
+        first_request, ready = run_once(args.preload, args.timeout)
+        first_requests.append(first_request)
+        readies.append(ready)
+        print(f"run {i + 1}: first request {first_request * 1000:.0f} ms, ready {ready * 1000:.0f} ms")
+
+    print(f"median: first request {statistics.median(first_requests) * 1000:.0f} ms, "
+          f"ready {statistics.median(readies) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Room camera check: runs the room monitor against local stub snapshot and MJPEG cameras.
+
+Run from examlyzer-backend/:
+
+    python check_room_cameras.py [--seconds 3] [--fps 10]
+"""
+import argparse
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from app.services.room_monitor import RoomMonitor, iter_jpeg_frames
+
+BOUNDARY = "frame"
+
+
+def make_jpeg(seed: int) -> bytes:
+    """A noisy frame, different for every seed so the change filter lets it through"""
+    image = np.random.default_rng(seed).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+class StubCameraHandler(BaseHTTPRequestHandler):
+    fps = 10.0
+    snapshots = 0
+
+    def do_GET(self):
+        if self.path == "/snapshot.jpg":
+            StubCameraHandler.snapshots += 1
+            frame = make_jpeg(StubCameraHandler.snapshots)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(frame)))
+            self.end_headers()
+            self.wfile.write(frame)
+            return
+        if self.path == "/stream":
+            self.send_response(200)
+            self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+            self.end_headers()
+            seed = 0
+            try:
+                while True:
+                    frame = make_jpeg(seed)
+                    seed += 1
+                    self.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                     f"Content-Length: {len(frame)}\r\n\r\n".encode())
+                    self.wfile.write(frame + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(1.0 / self.fps)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_camera(fps: float) -> ThreadingHTTPServer:
+    StubCameraHandler.fps = fps
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCameraHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_iter_jpeg_frames():
+    first, second = make_jpeg(1), make_jpeg(2)
+    stream = b"--frame\r\n" + first + b"\r\n--frame\r\n" + second
+    buffer = bytearray()
+    frames = []
+    # Feed it in small chunks so markers get split between them
+    for i in range(0, len(stream), 7):
+        buffer.extend(stream[i:i + 7])
+        frames.extend(iter_jpeg_frames(buffer))
+    assert frames == [first, second], f"expected 2 frames, got {len(frames)}"
+    print("iter_jpeg_frames: ok")
+
+
+async def check_monitor(base_url: str, seconds: float, max_fps: float, interval: float):
+    monitor = RoomMonitor({"snapshot": f"{base_url}/snapshot.jpg", "stream": f"{base_url}/stream"},
+                          interval=interval, max_fps=max_fps, workers=2)
+    await monitor.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await monitor.stop()
+
+    snapshot = monitor.states["snapshot"]
+    print(f"snapshot: {snapshot.snapshot()}")
+    assert snapshot.mode == "snapshot", f"snapshot camera detected as {snapshot.mode}"
+    assert snapshot.people_count is not None, f"snapshot camera never counted: {snapshot.error}"
+    # Polled once right away, then every interval
+    assert snapshot.frames_received <= seconds / interval + 1, "snapshot camera polled too often"
+
+    stream = monitor.states["stream"]
+    print(f"stream: {stream.snapshot()}")
+    assert stream.mode == "mjpeg", f"stream detected as {stream.mode}"
+    assert stream.people_count is not None, f"stream never counted: {stream.error}"
+    assert stream.frames_rate_limited > 0, "stream frames were not rate limited"
+    # The first detection is immediate, then at most max_fps
+    assert stream.frames_detected <= seconds * max_fps + 1, "stream detected above the rate limit"
+    print("room monitor: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--fps", type=float, default=10.0, help="frame rate of the stub stream")
+    parser.add_argument("--interval", type=float, default=1.0, help="snapshot poll interval")
+    parser.add_argument("--max-fps", type=float, default=2.0, help="detection rate limit per camera")
+    args = parser.parse_args()
+
+    check_iter_jpeg_frames()
+    server = start_stub_camera(args.fps)
+    try:
+        asyncio.run(check_monitor(f"http://127.0.0.1:{server.server_address[1]}", args.seconds, args.max_fps,
+                                  args.interval))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()